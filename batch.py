@@ -0,0 +1,225 @@
+from main import convertSpell, addOptionArguments, optionsFromArguments, DEFAULT_OPTIONS
+from manifest import loadManifest
+from export import exportToProject, printStats
+from soundindex import soundIndex
+from spell import frameCache
+from framecache import addCacheArgument, cacheBytesFromArguments
+from parse import SCRIPT_NAMES
+import profiling
+
+import imagebackends
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+def findSpells(rootPath):
+
+    spellPaths = []
+
+    for (dirPath, dirNames, fileNames) in os.walk(rootPath):
+
+        dirNames.sort()
+
+        if any(name in fileNames for name in SCRIPT_NAMES):
+            spellPaths.append(dirPath)
+
+    return spellPaths
+
+def initWorker(cacheBytes, backend):
+
+    # forked workers inherit the parent's hooks, they're run in the parent once results come back instead
+    del profiling.hooks[:]
+
+    if cacheBytes is not None:
+        frameCache.setBudget(cacheBytes)
+
+    # workers never show a window, don't require a display server
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    imagebackends.setBackend(backend)
+
+def convertOne(job):
+
+    (animationPath, outputPath, force, profile, options, threads, bundle) = job
+    spellName = os.path.basename(os.path.normpath(animationPath))
+
+    result = {
+        "path": animationPath,
+        "output": outputPath,
+        "error": None,
+        "status": None,
+        "columnsSaved": 0,
+        "sounds": [],
+        "missingSounds": [],
+        "quantization": None
+    }
+
+    profiler = profiling.Profiler(spellName) if profile else None
+    start = time.perf_counter()
+
+    try:
+        (spell, result["status"]) = convertSpell(spellName, animationPath, outputPath, force, profiler, options, threads, bundle)
+
+        if spell is not None:
+            result["columnsSaved"] = spell.duplicateFramesRemoved
+            result["quantization"] = spell.quantizationError
+            result["missingSounds"] = ["line %d: sound ID 0x%X" % missing for missing in spell.missingSounds] + ["sound file %s" % name for name in spell.missingSoundFiles]
+
+        # skipped spells still need their sounds in a shared folder
+        result["sounds"] = (loadManifest(outputPath) or {}).get("sounds", [])
+
+    except Exception:
+        result["error"] = traceback.format_exc().strip().splitlines()[-1]
+
+    result["seconds"] = time.perf_counter() - start
+    result["pid"] = os.getpid()
+    result["cache"] = frameCache.stats()
+
+    if profiler is not None:
+        result["profile"] = profiler.report()
+
+    return result
+
+# returns (results, sounds copied into a shared sound folder)
+def convertAll(rootPath, outputRoot, workers=None, cacheBytes=None, force=False, profile=False, options=None, backend="auto", threads=1):
+
+    soundFolder = dict(DEFAULT_OPTIONS, **(options or {}))["soundFolder"]
+
+    # a folder shared by every spell is filled once here rather than by racing workers
+    sharedSounds = os.path.isabs(soundFolder)
+
+    jobs = [
+        (animationPath, os.path.join(outputRoot, os.path.relpath(animationPath, rootPath)), force, profile, options, threads, not sharedSounds)
+        for animationPath in findSpells(rootPath)
+    ]
+
+    # indexed once before forking so workers inherit it
+    soundIndex.ensureLoaded()
+
+    with multiprocessing.Pool(workers, initializer=initWorker, initargs=(cacheBytes, backend)) as pool:
+        results = pool.map(convertOne, jobs, chunksize=1)
+
+    copied = 0
+
+    if sharedSounds:
+
+        sounds = {}
+
+        for result in results:
+            for name in result["sounds"]:
+                sounds.setdefault(name)
+
+        if sounds:
+            copied = soundIndex.bundle(list(sounds), soundFolder, merge=True)
+
+    for result in results:
+        for stage in result.get("profile", {"stages": []})["stages"]:
+            for hook in profiling.hooks:
+                hook(result["profile"]["spell"], stage)
+
+    return (results, copied)
+
+# per-spell reports plus per-stage totals across the batch
+def writeProfile(outputRoot, results):
+
+    totals = {}
+
+    for result in results:
+        for stage in result.get("profile", {"stages": []})["stages"]:
+
+            total = totals.setdefault(stage["stage"], {"seconds": 0, "peakBytes": 0, "count": 0})
+
+            total["seconds"] += stage["seconds"]
+            total["peakBytes"] = max(total["peakBytes"], stage["peakBytes"])
+            total["count"] += 1
+
+    os.makedirs(outputRoot, exist_ok=True)
+
+    with open(os.path.join(outputRoot, "profile.json"), "w") as profileFile:
+        json.dump({
+            "totals": totals,
+            "spells": [result["profile"] for result in results if "profile" in result]
+        }, profileFile, indent=4)
+
+def printSummary(results, soundsCopied=0):
+
+    failures = [result for result in results if result["error"] is not None]
+
+    for result in results:
+
+        if result["error"] is None:
+            line = "%-8s %7.2fs  %s" % (result["status"], result["seconds"], result["path"])
+
+            if result["status"] != "skipped":
+                line += " (%d duplicate frames)" % result["columnsSaved"]
+
+            print(line)
+
+            if result["quantization"] is not None:
+                print("          palette quantized from %(colours)d to %(paletteColours)d colours, mean error %(meanError).2f, max %(maxError).2f" % result["quantization"])
+
+            for missing in result["missingSounds"]:
+                print("          missing " + missing)
+
+        else:
+            print("FAILED   %7.2fs  %s" % (result["seconds"], result["path"]))
+            print("          " + result["error"])
+
+    print()
+    skipped = [result for result in results if result["status"] == "skipped"]
+
+    print("%d converted, %d up to date, %d failed, %.2fs total spell time" % (len(results) - len(failures) - len(skipped), len(skipped), len(failures), sum(result["seconds"] for result in results)))
+    print("%d sheet columns saved by frame deduplication" % sum(result["columnsSaved"] for result in results))
+    print("%d distinct sound(s) referenced, %d missing reference(s)" % (len({name for result in results for name in result["sounds"]}), sum(len(result["missingSounds"]) for result in results)))
+
+    if soundsCopied:
+        print("%d sound(s) copied into the shared sound folder" % soundsCopied)
+
+    # counters are cumulative per worker, so keep the latest snapshot from each process
+    workerStats = {}
+
+    for result in results:
+
+        stats = result["cache"]
+        previous = workerStats.get(result["pid"])
+
+        if previous is None or stats["hits"] + stats["misses"] > previous["hits"] + previous["misses"]:
+            workerStats[result["pid"]] = stats
+
+    print("frame cache: %d hits, %d misses, %d evictions" % tuple(sum(stats[key] for stats in workerStats.values()) for key in ("hits", "misses", "evictions")))
+
+def main():
+
+    argParser = argparse.ArgumentParser(description="Convert every spell folder (containing a Spell.txt or a compiled Spell.bin) under a root directory.")
+    argParser.add_argument("root", help="directory to search for spell folders")
+    argParser.add_argument("output", help="output directory, one subfolder is created per spell")
+    argParser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    argParser.add_argument("-f", "--force", action="store_true", help="rebuild every spell even if its inputs haven't changed")
+    argParser.add_argument("--profile", action="store_true", help="record per-stage timings and memory, written to profile.json in the output directory")
+    addCacheArgument(argParser)
+    addOptionArguments(argParser)
+    imagebackends.addBackendArgument(argParser)
+    argParser.add_argument("-t", "--threads", type=int, default=1, help="threads per worker for decoding and palettizing frames (default: 1, the pool already uses every core)")
+    argParser.add_argument("--project", help="merge the converted spells into this Lex Talionis project's combat effect and palette catalogs")
+    args = argParser.parse_args()
+
+    start = time.perf_counter()
+    (results, soundsCopied) = convertAll(args.root, args.output, args.workers, cacheBytesFromArguments(args), args.force, args.profile, optionsFromArguments(args), args.backend, args.threads)
+
+    printSummary(results, soundsCopied)
+
+    if args.profile:
+        writeProfile(args.output, results)
+
+    # up to date spells are exported too, the project may not have them yet
+    if args.project:
+        printStats(exportToProject(args.project, [result["output"] for result in results if result["error"] is None]))
+
+    print("wall time %.2fs" % (time.perf_counter() - start))
+
+    return 1 if any(result["error"] is not None for result in results) else 0
+
+if __name__ == "__main__":
+    exit(main())
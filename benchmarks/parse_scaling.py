@@ -0,0 +1,57 @@
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parse import Parser
+
+SIZES_MB = [1, 2, 4, 8, 16]
+
+# a Spell.txt-shaped script of roughly the given size, cycling through a handful of frames
+def writeScript(path, sizeBytes, seed=0):
+
+    random.seed(seed)
+    written = 0
+
+    with open(path, "w") as scriptFile:
+
+        while written < sizeBytes:
+
+            chunk = ""
+
+            if random.random() < 0.1:
+                chunk += "# comment\n"
+
+            if random.random() < 0.2:
+                chunk += random.choice(["C000029", "C001029", "C00001F", "C005A48", "C000040"]) + "\n"
+
+            chunk += "O  p- bg_%03d.png\n   p- fg_%03d.png\n%d\n" % (random.randrange(4), random.randrange(60), random.randrange(1, 5))
+
+            if written == 0:
+                chunk += "~\n"
+
+            scriptFile.write(chunk)
+            written += len(chunk)
+
+def main():
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        print("%8s %10s %10s" % ("MB", "seconds", "MB/s"))
+
+        for sizeMB in SIZES_MB:
+
+            path = os.path.join(tempDir, "Spell.txt")
+            writeScript(path, sizeMB * 1024 * 1024)
+
+            start = time.perf_counter()
+            Parser("Bench").parse(path)
+            seconds = time.perf_counter() - start
+
+            print("%8d %10.3f %10.1f" % (sizeMB, seconds, sizeMB / seconds))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generateSpell
+from parse import Parser
+from spell import Spell, frameCache
+from framecache import addCacheArgument, cacheBytesFromArguments
+import imagebackends
+
+import argparse
+import tempfile
+import tracemalloc
+
+FRAME_COUNTS = [100, 400, 800]
+
+# peak resident set size in bytes since the last reset, None where /proc doesn't offer it
+def peakResidentBytes():
+
+    try:
+        with open("/proc/self/status") as statusFile:
+            for line in statusFile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+
+    except OSError:
+        pass
+
+    return None
+
+def resetPeakResident():
+
+    try:
+        with open("/proc/self/clear_refs", "w") as clearFile:
+            clearFile.write("5")
+
+    except OSError:
+        pass
+
+# (traced peak, resident peak) bytes above what was in use before the foreground sheet was written
+def measureSheet(spellPath, height):
+
+    spell = Parser("Memory").parse(os.path.join(spellPath, "Spell.txt"))
+    spell.deduplicateFrames(spellPath)
+    spell.calculatePalettes(spellPath)
+
+    sheetPaths = [os.path.join(spellPath, name + ".png") for name in Spell.sheetNames("FG", spell.getForegroundLayout().pages)]
+
+    tracemalloc.start()
+    resetPeakResident()
+    residentBefore = peakResidentBytes()
+
+    spell.writeForegroundSheets(spellPath, sheetPaths)
+
+    tracedPeak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    residentPeak = peakResidentBytes()
+
+    return (tracedPeak, None if residentBefore is None else residentPeak - residentBefore)
+
+def main():
+
+    argParser = argparse.ArgumentParser(description="Peak memory of writing one stretched foreground sheet as the frame count grows; it should stay flat.")
+    argParser.add_argument("--height", type=int, default=64, help="foreground frame height (default: 64, stretched)")
+    argParser.add_argument("--frames", type=int, action="append", help="frame count to measure, can be repeated")
+    imagebackends.addBackendArgument(argParser)
+    addCacheArgument(argParser)
+    args = argParser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    imagebackends.setBackend(args.backend)
+    frameCache.setBudget(cacheBytesFromArguments(args))
+
+    print("%8s %12s %12s" % ("frames", "traced MB", "resident MB"))
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        for frames in args.frames or FRAME_COUNTS:
+
+            spellPath = os.path.join(tempDir, "spell%d" % frames)
+            generateSpell(spellPath, frames, args.height, 16, 4)
+
+            frameCache.clear()
+            (traced, resident) = measureSheet(spellPath, args.height)
+
+            print("%8d %12.2f %12s" % (frames, traced / 1024 / 1024, "-" if resident is None else "%.2f" % (resident / 1024 / 1024)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generateSpell
+from manifest import CONVERTER_VERSION
+from parse import Parser
+from spell import Spell, frameCache
+import imagebackends
+
+import argparse
+import json
+import platform
+import tempfile
+import time
+
+# name, frames, foreground height, colours, backgrounds, command density
+DEFAULT_CASES = [
+    ["baseline", 60, 160, 16, 4, 0.1],
+    ["stretched", 60, 64, 16, 4, 0.1],
+    ["no_background", 60, 160, 16, 0, 0.1],
+    ["many_colours", 60, 160, 128, 4, 0.1],
+    ["long", 240, 160, 16, 8, 0.1],
+    ["command_heavy", 60, 160, 16, 4, 1.0]
+]
+
+JSON_STAGES = [
+    "generateParentEffectJSON",
+    "generateForegroundOnHitJSON",
+    "generateForegroundOnMissJSON",
+    "generateForegroundOnHitPaletteJSON",
+    "generateForegroundOnMissPaletteJSON"
+]
+
+BACKGROUND_JSON_STAGES = [
+    "generateBackgroundOnHitJSON",
+    "generateBackgroundOnMissJSON",
+    "generateBackgroundOnHitPaletteJSON",
+    "generateBackgroundOnMissPaletteJSON"
+]
+
+def timed(timings, name, function, *args):
+
+    start = time.perf_counter()
+    result = function(*args)
+    timings[name] = time.perf_counter() - start
+
+    return result
+
+# one pass through the pipeline in the order main.convertSpell runs it, starting from a cold frame cache
+def runStages(spellPath, name, threads=1):
+
+    frameCache.clear()
+    timings = {}
+
+    spell = timed(timings, "parse", Parser(name).parse, os.path.join(spellPath, "Spell.txt"))
+    spell.frameThreads = threads
+
+    timed(timings, "deduplicateFrames", spell.deduplicateFrames, spellPath)
+    timed(timings, "calculatePalettes", spell.calculatePalettes, spellPath)
+
+    for stage in JSON_STAGES + ([] if spell.skipBackground else BACKGROUND_JSON_STAGES):
+        timed(timings, stage, getattr(spell, stage))
+
+    # sheets are streamed to disk, so encoding is part of these stages
+    sheetPath = os.path.join(spellPath, "sheets")
+    os.makedirs(sheetPath, exist_ok=True)
+
+    foregroundPaths = [os.path.join(sheetPath, name + ".png") for name in Spell.sheetNames("FG", spell.getForegroundLayout().pages)]
+    timed(timings, "writeForegroundSheets", spell.writeForegroundSheets, spellPath, foregroundPaths)
+
+    if not spell.skipBackground:
+        backgroundPaths = [os.path.join(sheetPath, name + ".png") for name in Spell.sheetNames("BG", spell.getBackgroundLayout().pages)]
+        timed(timings, "writeBackgroundSheets", spell.writeBackgroundSheets, spellPath, backgroundPaths)
+
+    return timings
+
+def runCase(tempDir, case, repeat, threads=1):
+
+    (name, frames, height, colours, backgrounds, commandDensity) = case
+    spellPath = os.path.join(tempDir, name)
+
+    generateSpell(spellPath, frames, height, colours, backgrounds, commandDensity)
+
+    # keep the fastest run of each stage
+    best = {}
+
+    for _ in range(repeat):
+        for (stage, seconds) in runStages(spellPath, name, threads).items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+
+    return {
+        "name": name,
+        "frames": frames,
+        "height": height,
+        "colours": colours,
+        "backgrounds": backgrounds,
+        "commandDensity": commandDensity,
+        "stages": best,
+        "total": sum(best.values())
+    }
+
+def main():
+
+    argParser = argparse.ArgumentParser(description="Time each conversion stage on generated spells.")
+    argParser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    argParser.add_argument("-r", "--repeat", type=int, default=3, help="runs per case, the fastest is kept (default: 3)")
+    imagebackends.addBackendArgument(argParser)
+    argParser.add_argument("-t", "--threads", type=int, default=1, help="threads per spell for frame decoding and palettization (default: 1)")
+    argParser.add_argument("--case", action="append", nargs=6, metavar=("NAME", "FRAMES", "HEIGHT", "COLOURS", "BACKGROUNDS", "DENSITY"), help="custom case, can be repeated (replaces the default cases)")
+    args = argParser.parse_args()
+
+    cases = DEFAULT_CASES
+
+    if args.case:
+        cases = [[name, int(frames), int(height), int(colours), int(backgrounds), float(density)] for (name, frames, height, colours, backgrounds, density) in args.case]
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    backend = imagebackends.setBackend(args.backend)
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        results = [runCase(tempDir, case, args.repeat, args.threads) for case in cases]
+
+    for result in results:
+        print("%-16s %8.3fs" % (result["name"], result["total"]))
+
+        for (stage, seconds) in result["stages"].items():
+            print("    %-36s %8.4fs" % (stage, seconds))
+
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump({
+                "converterVersion": CONVERTER_VERSION,
+                "backend": backend,
+                "threads": args.threads,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cases": results
+            }, outputFile, indent=4)
+
+if __name__ == "__main__":
+    main()
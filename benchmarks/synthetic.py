@@ -0,0 +1,80 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spell import SCREEN_WIDTH, BACKGROUND_WIDTH, BACKGROUND_HEIGHT
+import imagebackends
+import numpy as np
+
+BLOCK_SIZE = 8
+
+def randomPalette(rng, count):
+
+    # GBA colours are 5 bits per channel, keep them distinct
+    packed = rng.choice(1 << 15, size=count, replace=False)
+
+    r = (packed >> 10 & 0x1F) << 3
+    g = (packed >> 5 & 0x1F) << 3
+    b = (packed & 0x1F) << 3
+
+    return (r << 16 | g << 8 | b).astype(np.uint32)
+
+def blockImage(rng, palette, height, width):
+
+    blocks = rng.choice(palette, size=(-(-height // BLOCK_SIZE), -(-width // BLOCK_SIZE)))
+    return np.repeat(np.repeat(blocks, BLOCK_SIZE, axis=0), BLOCK_SIZE, axis=1)[:height, :width]
+
+# writes Spell.txt and its frames into path
+def generateSpell(path, frames=60, height=160, colours=16, backgrounds=4, commandDensity=0.1, seed=0):
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(path, exist_ok=True)
+
+    foregroundPalette = randomPalette(rng, colours)
+    foregroundNames = []
+
+    for idx in range(frames):
+
+        name = "fg_%04d.png" % idx
+        imagebackends.writeImage(os.path.join(path, name), blockImage(rng, foregroundPalette, height, SCREEN_WIDTH))
+        foregroundNames.append(name)
+
+    # a single background is treated as "no background" by the converter
+    backgroundPalette = randomPalette(rng, 16)
+    backgroundNames = []
+
+    for idx in range(max(backgrounds, 1)):
+
+        pixels = blockImage(rng, backgroundPalette, BACKGROUND_HEIGHT, BACKGROUND_WIDTH)
+        pixels[:2, BACKGROUND_WIDTH - 8:] = backgroundPalette.reshape(2, 8)[:, ::-1]
+
+        name = "bg_%04d.png" % idx
+        imagebackends.writeImage(os.path.join(path, name), pixels)
+        backgroundNames.append(name)
+
+    lines = ["# synthetic spell, %d frames" % frames]
+
+    for idx in range(frames):
+
+        if idx == frames // 2:
+            lines.append("C00001F")
+
+        if idx == frames * 3 // 4:
+            lines.append("~")
+
+        if rng.random() < commandDensity:
+            lines.append("C005A48")
+
+        if rng.random() < commandDensity:
+            lines.append(rng.choice(["C000029", "C001029"]))
+
+        if rng.random() < commandDensity:
+            lines.append("C000040")
+
+        lines.append("O  p- %s" % backgroundNames[idx % len(backgroundNames)])
+        lines.append("   p- %s" % foregroundNames[idx])
+        lines.append(str(rng.integers(1, 5)))
+
+    with open(os.path.join(path, "Spell.txt"), "w") as spellFile:
+        spellFile.write("\n".join(lines) + "\n")
@@ -0,0 +1,157 @@
+from manifest import loadManifest, MANIFEST_NAME
+
+import argparse
+import json
+import os
+import shutil
+
+# where a Lex Talionis project keeps its combat effects (catalog plus one <nid>.png sheet per effect) and palettes
+EFFECTS_FOLDER = os.path.join("resources", "combat_effects")
+EFFECTS_CATALOG = "combat_effects.json"
+
+PALETTES_FOLDER = os.path.join("resources", "combat_palettes")
+PALETTES_CATALOG = "combat_palettes.json"
+
+# (effects, palettes, sheet paths) a converted spell's manifest lists
+def readOutputs(outputPath):
+
+    manifest = loadManifest(outputPath)
+
+    if manifest is None:
+        raise ValueError("%s has no manifest, convert it first" % outputPath)
+
+    effects = []
+    palettes = []
+    sheets = []
+
+    for output in manifest["outputs"]:
+
+        # bundled sounds live in a subfolder and aren't part of these catalogs
+        if os.path.dirname(output):
+            continue
+
+        if output.endswith("_effect.json"):
+            with open(os.path.join(outputPath, output)) as effectFile:
+                effects.append(json.load(effectFile))
+
+            # older conversions listed several sheets in one effect, which the engine never reads past the first
+            if "sheets" in effects[-1]:
+                raise ValueError("%s in %s spans several sheets, convert the spell again to split it into one effect per sheet" % (output, outputPath))
+
+        elif output.endswith("_palette.json"):
+            with open(os.path.join(outputPath, output)) as paletteFile:
+                palettes.append(json.load(paletteFile))
+
+        elif output.endswith(".png"):
+            sheets.append(os.path.join(outputPath, output))
+
+    return (effects, palettes, sheets)
+
+def loadCatalog(catalogPath):
+
+    try:
+        with open(catalogPath) as catalogFile:
+            return json.load(catalogFile)
+
+    except FileNotFoundError:
+        return []
+
+# replaces entries with the same nid where they are, appends the rest; returns (replaced, added)
+def mergeByNid(catalog, entries, nidOf):
+
+    positions = {nidOf(entry): idx for (idx, entry) in enumerate(catalog)}
+
+    replaced = 0
+    added = 0
+
+    for entry in entries:
+
+        nid = nidOf(entry)
+
+        if nid in positions:
+            catalog[positions[nid]] = entry
+            replaced += 1
+
+        else:
+            positions[nid] = len(catalog)
+            catalog.append(entry)
+            added += 1
+
+    return (replaced, added)
+
+def saveCatalog(catalogPath, catalog):
+
+    # write then rename, the editor never sees a half written catalog
+    with open(catalogPath + ".tmp", "w") as catalogFile:
+        json.dump(catalog, catalogFile, indent=4)
+
+    os.replace(catalogPath + ".tmp", catalogPath)
+
+# merges every spell's outputs into the project with a single read and write per catalog
+# sheets are copied first, so a catalog is never saved pointing at images that aren't there
+def exportToProject(projectPath, outputPaths):
+
+    if not os.path.isdir(os.path.join(projectPath, "resources")):
+        raise ValueError("%s doesn't look like a Lex Talionis project, it has no resources folder" % projectPath)
+
+    effects = []
+    palettes = []
+    sheets = []
+
+    for outputPath in outputPaths:
+
+        (spellEffects, spellPalettes, spellSheets) = readOutputs(outputPath)
+
+        effects += spellEffects
+        palettes += spellPalettes
+        sheets += spellSheets
+
+    effectsPath = os.path.join(projectPath, EFFECTS_FOLDER)
+    palettesPath = os.path.join(projectPath, PALETTES_FOLDER)
+
+    os.makedirs(effectsPath, exist_ok=True)
+    os.makedirs(palettesPath, exist_ok=True)
+
+    for sheet in sheets:
+
+        # copied beside the target then renamed, the editor never sees a half written sheet
+        targetPath = os.path.join(effectsPath, os.path.basename(sheet))
+        shutil.copyfile(sheet, targetPath + ".tmp")
+        os.replace(targetPath + ".tmp", targetPath)
+
+    stats = {"sheets": len(sheets)}
+
+    effectCatalog = loadCatalog(os.path.join(effectsPath, EFFECTS_CATALOG))
+    (stats["effectsReplaced"], stats["effectsAdded"]) = mergeByNid(effectCatalog, effects, lambda effect: effect["nid"])
+    saveCatalog(os.path.join(effectsPath, EFFECTS_CATALOG), effectCatalog)
+
+    paletteCatalog = loadCatalog(os.path.join(palettesPath, PALETTES_CATALOG))
+    (stats["palettesReplaced"], stats["palettesAdded"]) = mergeByNid(paletteCatalog, palettes, lambda palette: palette[0])
+    saveCatalog(os.path.join(palettesPath, PALETTES_CATALOG), paletteCatalog)
+
+    return stats
+
+def printStats(stats):
+    print("project: %d effect(s) replaced, %d added; %d palette(s) replaced, %d added; %d sheet(s) copied" % (stats["effectsReplaced"], stats["effectsAdded"], stats["palettesReplaced"], stats["palettesAdded"], stats["sheets"]))
+
+def main():
+
+    argParser = argparse.ArgumentParser(description="Merge converted spells into a Lex Talionis project's combat effect and palette catalogs.")
+    argParser.add_argument("project", help="the project folder, containing resources/")
+    argParser.add_argument("outputs", nargs="+", help="spell output folders, or directories containing them")
+    args = argParser.parse_args()
+
+    outputPaths = []
+
+    for path in args.outputs:
+        for (dirPath, dirNames, fileNames) in os.walk(path):
+
+            dirNames.sort()
+
+            if MANIFEST_NAME in fileNames:
+                outputPaths.append(dirPath)
+
+    printStats(exportToProject(args.project, outputPaths))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import os
+import threading
+
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+
+# decoded frames keyed by path, invalidated when the file's mtime or size changes
+class FrameCache:
+
+    def __init__(self, decode, budgetBytes=DEFAULT_BUDGET_BYTES):
+
+        self.decode = decode
+        self.budgetBytes = budgetBytes
+
+        self.entries = OrderedDict()
+        self.currentBytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+
+    # store=False serves a cached frame but doesn't add or refresh one, for passes that read each frame
+    # once and shouldn't push out the frames other passes will want again
+    def get(self, path, store=True):
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+
+            entry = self.entries.get(path)
+
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+
+                if store:
+                    self.entries.move_to_end(path)
+
+                return entry[1]
+
+            self.misses += 1
+
+        pixels = self.decode(path)
+        pixels.setflags(write=False)
+
+        if not store:
+            return pixels
+
+        with self.lock:
+
+            if path in self.entries:
+                self.currentBytes -= self.entries.pop(path)[1].nbytes
+
+            if pixels.nbytes <= self.budgetBytes:
+                self.entries[path] = (version, pixels)
+                self.currentBytes += pixels.nbytes
+
+            self.trim()
+
+        return pixels
+
+    def setBudget(self, budgetBytes):
+
+        with self.lock:
+
+            self.budgetBytes = budgetBytes
+            self.trim()
+
+    # caller holds the lock
+    def trim(self):
+
+        while self.currentBytes > self.budgetBytes:
+            self.currentBytes -= self.entries.popitem(last=False)[1][1].nbytes
+            self.evictions += 1
+
+    def clear(self):
+
+        with self.lock:
+            self.entries.clear()
+            self.currentBytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.currentBytes,
+            "budget_bytes": self.budgetBytes
+        }
+
+# --cache-mb for every entry point that decodes frames
+def addCacheArgument(argParser):
+    argParser.add_argument("--cache-mb", dest="cacheMB", metavar="MB", type=int, default=None, help="decoded frame cache budget in MB, per worker when there are several (default: %d)" % (DEFAULT_BUDGET_BYTES // 1024 // 1024))
+
+def cacheBytesFromArguments(args):
+    return DEFAULT_BUDGET_BYTES if args.cacheMB is None else args.cacheMB * 1024 * 1024
@@ -0,0 +1,55 @@
+from imagebackends import arraypng
+import importlib
+import importlib.util
+import os
+
+# every backend module provides start(), readImage(path) and writeImage(path, pixels), working on
+# uint32 arrays of 0xRRGGBB pixels, so Spell never touches an image library directly
+BACKENDS = {
+    "qt": "imagebackends.qt",
+    "array": "imagebackends.arraypng"
+}
+
+backend = None
+backendName = None
+
+# "auto" honours LT_IMAGE_BACKEND, then prefers Qt when PyQt5 is installed
+def setBackend(name="auto"):
+
+    global backend, backendName
+
+    if name == "auto":
+        name = os.environ.get("LT_IMAGE_BACKEND", "auto")
+
+    if name == "auto":
+        name = "qt" if importlib.util.find_spec("PyQt5") is not None else "array"
+
+    if name not in BACKENDS:
+        raise ValueError("unknown image backend %r, expected one of %s" % (name, ", ".join(BACKENDS)))
+
+    backend = importlib.import_module(BACKENDS[name])
+    backend.start()
+    backendName = name
+
+    return name
+
+def getBackend():
+
+    if backend is None:
+        setBackend()
+
+    return backend
+
+def readImage(path):
+    return getBackend().readImage(path)
+
+def writeImage(path, pixels):
+    return getBackend().writeImage(path, pixels)
+
+# incremental PNG encoder with writeRows(pixels) and close(), for images too big to hold at once
+# the output is plain 8-bit RGB, or indexed given a palette, which every backend reads, so it doesn't depend on the backend in use
+def openImageWriter(path, width, height, palette=None):
+    return arraypng.StreamWriter(path, width, height, palette)
+
+def addBackendArgument(argParser):
+    argParser.add_argument("--backend", choices=["auto"] + list(BACKENDS), default="auto", help="image library used to read and write PNGs (default: Qt if installed)")
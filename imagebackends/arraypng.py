@@ -0,0 +1,373 @@
+import numpy as np
+import os
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# samples per pixel for each PNG colour type
+CHANNELS = {
+    0: 1,
+    2: 3,
+    3: 1,
+    4: 2,
+    6: 4
+}
+
+def start():
+    pass
+
+def readChunks(data):
+
+    offset = len(PNG_SIGNATURE)
+
+    while offset + 8 <= len(data):
+
+        (length, chunkType) = struct.unpack_from(">I4s", data, offset)
+        yield (chunkType, data[offset + 8:offset + 8 + length])
+
+        offset += 12 + length
+
+# whole-row passes over an Average row before its unsettled bytes are redone one at a time
+AVERAGE_ROUNDS = 3
+
+# the byte bpp to the left of each one, 0 for the first pixel
+def shiftLeft(row, bpp):
+
+    shifted = np.zeros_like(row)
+    shifted[bpp:] = row[:-bpp]
+
+    return shifted
+
+# Average and Paeth depend on the byte to the left, which rules out a single pass over the row. Instead every
+# byte lane of the row is solved at once from a guess, and each byte is checked against the filter using its
+# solved left neighbour. Bytes are then redone one at a time only from the first that fails; once the redone
+# bytes agree with the solution for a whole pixel the solution holds again up to the next failing byte, since
+# it satisfies the filter everywhere in between, so the loop skips ahead to it (the row length ends the list)
+
+def unfilterAverage(line, previous, bpp):
+
+    f = line.astype(np.uint16)
+    b = previous.astype(np.uint16)
+
+    # a guess of 0 to the left, refined a few times; differences fade as they're halved from byte to byte
+    out = (f + (b >> 1)) & 0xFF
+
+    for _ in range(AVERAGE_ROUNDS):
+        out = (f + ((shiftLeft(out, bpp) + b) >> 1)) & 0xFF
+
+    # the bytes are padded with a zero pixel on the left so the loop needs no edge checks
+    failing = (np.flatnonzero((f + ((shiftLeft(out, bpp) + b) >> 1)) & 0xFF != out) + bpp).tolist()
+
+    out = bytearray(bpp) + out.astype(np.uint8).tobytes()
+    (line, previous) = (bytes(bpp) + line.tobytes(), bytes(bpp) + previous.tobytes())
+
+    length = len(out)
+    failing.append(length)
+
+    (i, next, agreed) = (failing[0], 1, 0)
+
+    while i < length:
+
+        value = (line[i] + ((out[i - bpp] + previous[i]) >> 1)) & 0xFF
+
+        if out[i] == value:
+            agreed += 1
+
+        else:
+            out[i] = value
+            agreed = 0
+
+        i += 1
+
+        if agreed >= bpp:
+
+            while failing[next] < i:
+                next += 1
+
+            (i, agreed) = (failing[next], 0)
+
+    return np.frombuffer(out, np.uint8, offset=bpp)
+
+# with the choices fixed (0 left, 1 above, 2 above-left), bytes predicted from above or above-left are known
+# outright and each one predicted from the left adds onto the last known byte in its lane, so a running sum
+# restarted at every known byte solves the row; lanes are laid end to end, each restarting the sum at its
+# first byte (whose left neighbour is 0), and all of it wraps at 256 like the bytes themselves
+def paethRow(f, b, c, choices, bpp):
+
+    known = (f + np.where(choices == 1, b, c)).astype(np.uint8)
+    values = np.where(choices == 0, f.astype(np.uint8), known).reshape(-1, bpp).T.ravel()
+
+    restarts = (choices != 0).reshape(-1, bpp).T.copy()
+    restarts[:, 0] = True
+    restarts = restarts.ravel()
+
+    total = np.cumsum(values, dtype=np.uint8)
+    before = np.zeros_like(total)
+    before[1:] = total[:-1]
+
+    starts = np.where(restarts, np.arange(len(total)), 0)
+    np.maximum.accumulate(starts, out=starts)
+
+    return (total - before[starts]).reshape(bpp, -1).T.ravel()
+
+def unfilterPaeth(line, previous, bpp):
+
+    f = line.astype(np.int16)
+    b = previous.astype(np.int16)
+    c = shiftLeft(b, bpp)
+
+    # Paeth predicts from the left when |b - c| is smallest, from above when |a - c| is, else from above-left
+    e = b - c
+    pa = np.abs(e)
+
+    # flat areas repeat the row above, where Paeth always predicts from the left; elsewhere guess above
+    choices = np.where(e == 0, 0, 1)
+    out = paethRow(f, b, c, choices, bpp)
+
+    d = shiftLeft(out.astype(np.int16), bpp) - c
+    pb = np.abs(d)
+    pc = np.abs(d + e)
+
+    # the bytes are padded with a zero pixel on the left so the loop needs no edge checks
+    failing = (np.flatnonzero(np.where((pa <= pb) & (pa <= pc), 0, np.where(pb <= pc, 1, 2)) != choices) + bpp).tolist()
+
+    out = bytearray(bpp) + out.tobytes()
+    (line, previous) = (bytes(bpp) + line.tobytes(), bytes(bpp) + previous.tobytes())
+    (steps, leftDistances) = ([0] * bpp + e.tolist(), [0] * bpp + pa.tolist())
+
+    length = len(out)
+    failing.append(length)
+
+    (i, next, agreed) = (failing[0], 1, 0)
+
+    while i < length:
+
+        a = out[i - bpp]
+        c = previous[i - bpp]
+
+        d = a - c
+        pb = abs(d)
+        pc = abs(d + steps[i])
+
+        if leftDistances[i] <= pb and leftDistances[i] <= pc:
+            value = (line[i] + a) & 0xFF
+
+        elif pb <= pc:
+            value = (line[i] + previous[i]) & 0xFF
+
+        else:
+            value = (line[i] + c) & 0xFF
+
+        if out[i] == value:
+            agreed += 1
+
+        else:
+            out[i] = value
+            agreed = 0
+
+        i += 1
+
+        if agreed >= bpp:
+
+            while failing[next] < i:
+                next += 1
+
+            (i, agreed) = (failing[next], 0)
+
+    return np.frombuffer(out, np.uint8, offset=bpp)
+
+def unfilter(raw, height, stride, bpp):
+
+    scanlines = np.frombuffer(raw, np.uint8, count=height * (stride + 1)).reshape(height, stride + 1)
+    rows = np.empty((height, stride), np.uint8)
+    previous = np.zeros(stride, np.uint8)
+
+    for y in range(height):
+
+        line = scanlines[y, 1:]
+
+        match scanlines[y, 0]:
+
+            case 0:
+                rows[y] = line
+
+            case 1:
+                rows[y] = np.cumsum(line.reshape(-1, bpp), axis=0, dtype=np.uint8).ravel()
+
+            case 2:
+                rows[y] = line + previous
+
+            case 3:
+                rows[y] = unfilterAverage(line, previous, bpp)
+
+            case 4:
+                rows[y] = unfilterPaeth(line, previous, bpp)
+
+            case filterType:
+                raise ValueError("unknown PNG filter type %d" % filterType)
+
+        previous = rows[y]
+
+    return rows
+
+def readImage(path):
+
+    with open(path, "rb") as imageFile:
+        data = imageFile.read()
+
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("couldn't read image %s: not a PNG" % path)
+
+    palette = None
+    compressed = []
+
+    for (chunkType, chunk) in readChunks(data):
+
+        match chunkType:
+
+            case b"IHDR":
+                (width, height, bitDepth, colourType, compression, filterMethod, interlace) = struct.unpack(">IIBBBBB", chunk)
+
+            case b"PLTE":
+                palette = np.frombuffer(chunk, np.uint8).reshape(-1, 3).astype(np.uint32)
+
+            case b"IDAT":
+                compressed.append(chunk)
+
+            case b"IEND":
+                break
+
+    if interlace != 0:
+        raise ValueError("couldn't read image %s: interlaced PNGs aren't supported" % path)
+
+    channels = CHANNELS[colourType]
+    bitsPerPixel = channels * bitDepth
+    stride = (width * bitsPerPixel + 7) // 8
+
+    rows = unfilter(zlib.decompress(b"".join(compressed)), height, stride, max(1, bitsPerPixel // 8))
+
+    if bitDepth < 8:
+        shifts = np.arange(8 - bitDepth, -1, -bitDepth, dtype=np.uint8)
+        samples = ((rows[:, :, None] >> shifts) & ((1 << bitDepth) - 1)).reshape(height, -1)[:, :width]
+
+    elif bitDepth == 16:
+        # rounded to 8 bits the way Qt converts them, so both backends see the same colours
+        pairs = rows.reshape(height, -1, 2).astype(np.uint32)
+        samples = ((pairs[:, :, 0] << 8 | pairs[:, :, 1]) * 255 + 32767) // 65535
+
+    else:
+        samples = rows
+
+    samples = samples.reshape(height, width, channels).astype(np.uint32)
+
+    match colourType:
+
+        case 3:
+            rgb = palette[samples[:, :, 0]]
+
+        case 0 | 4:
+            grey = samples[:, :, 0] * 255 // ((1 << min(bitDepth, 8)) - 1)
+            rgb = np.stack([grey, grey, grey], axis=-1)
+
+        case _:
+            rgb = samples[:, :, :3]
+
+    return rgb[:, :, 0] << 16 | rgb[:, :, 1] << 8 | rgb[:, :, 2]
+
+def writeChunk(output, chunkType, data):
+    output.write(struct.pack(">I", len(data)) + chunkType + data + struct.pack(">I", zlib.crc32(chunkType + data)))
+
+# written a band of rows at a time, every row filtered with Up, which suits the vertically repetitive
+# sheets; only the previous row and zlib's window are kept between bands
+# 8-bit RGB rows of 0xRRGGBB pixels, or with a palette of up to 256 (r, g, b) colours, 8-bit indexed rows of uint8 indices
+class StreamWriter:
+
+    def __init__(self, path, width, height, palette=None):
+
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rowsWritten = 0
+
+        self.indexed = palette is not None
+        self.rowBytes = width if self.indexed else width * 3
+
+        self.previous = np.zeros(self.rowBytes, np.uint8)
+        self.compressor = zlib.compressobj(6)
+
+        self.output = open(path, "wb")
+        self.output.write(PNG_SIGNATURE)
+
+        if self.indexed:
+
+            if not 0 < len(palette) <= 256:
+                self.output.close()
+                raise ValueError("an indexed PNG holds 1 to 256 colours, not %d" % len(palette))
+
+            writeChunk(self.output, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+            writeChunk(self.output, b"PLTE", bytes(channel for colour in palette for channel in colour))
+
+        else:
+            writeChunk(self.output, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def writeRows(self, pixels):
+
+        height = pixels.shape[0]
+
+        if self.indexed:
+            rows = np.ascontiguousarray(pixels, np.uint8)
+
+        else:
+            rgb = np.empty((height, self.width, 3), np.uint8)
+            rgb[:, :, 0] = pixels >> 16 & 0xFF
+            rgb[:, :, 1] = pixels >> 8 & 0xFF
+            rgb[:, :, 2] = pixels & 0xFF
+
+            rows = rgb.reshape(height, self.rowBytes)
+
+        filtered = np.empty((height, self.rowBytes + 1), np.uint8)
+
+        filtered[:, 0] = 2
+        filtered[0, 1:] = rows[0] - self.previous
+        filtered[1:, 1:] = rows[1:] - rows[:-1]
+
+        self.previous = rows[-1].copy()
+        self.rowsWritten += height
+
+        data = self.compressor.compress(filtered.tobytes())
+
+        if data:
+            writeChunk(self.output, b"IDAT", data)
+
+    def close(self):
+
+        try:
+            if self.rowsWritten != self.height:
+                raise ValueError("wrote %d of %d rows" % (self.rowsWritten, self.height))
+
+            writeChunk(self.output, b"IDAT", self.compressor.flush())
+            writeChunk(self.output, b"IEND", b"")
+
+        finally:
+            self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+
+        if excType is None:
+            self.close()
+
+        # don't leave a truncated PNG behind
+        else:
+            self.output.close()
+            os.remove(self.path)
+
+def writeImage(path, pixels):
+
+    height, width = pixels.shape
+
+    with StreamWriter(path, width, height) as writer:
+        writer.writeRows(pixels)
@@ -0,0 +1,40 @@
+from PyQt5 import QtGui
+from PyQt5.QtGui import QImage
+import numpy as np
+
+app = None
+
+# QImage's plugins expect an application object, create one unless the caller already has
+def start():
+
+    global app
+
+    if QtGui.QGuiApplication.instance() is None:
+        app = QtGui.QGuiApplication([])
+
+def readImage(path):
+
+    image = QImage(path)
+
+    if image.isNull():
+        raise ValueError("couldn't read image %s" % path)
+
+    image = image.convertToFormat(QImage.Format.Format_ARGB32)
+
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+
+    pixels = np.frombuffer(bits, np.uint32).reshape(image.height(), image.bytesPerLine() // 4)
+
+    return pixels[:, :image.width()] & 0xFFFFFF
+
+def writeImage(path, pixels):
+
+    height, width = pixels.shape
+    pixels = np.ascontiguousarray(pixels | 0xFF000000, np.uint32)
+
+    # QImage doesn't own the buffer, so it has to be saved before pixels goes out of scope
+    image = QImage(pixels.data, width, height, width * 4, QImage.Format.Format_RGB32)
+
+    if not image.save(path):
+        raise OSError("couldn't write image %s" % path)
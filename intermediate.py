@@ -0,0 +1,103 @@
+from spell import Spell
+from timeline import Timeline, Command
+
+import json
+import os
+import zlib
+
+# bump whenever the saved fields change; older files are ignored and the spell is parsed again
+IR_VERSION = 2
+
+IR_NAME = "spell.ir"
+
+def paletteToList(paletteData):
+    return [[*colour, *index] for (colour, index) in paletteData.items()]
+
+def paletteFromList(entries):
+    return {(r, g, b): [x, y] for (r, g, b, x, y) in entries}
+
+def colourMapToList(colourMap):
+    return [[*colour, *target] for (colour, target) in colourMap.items()]
+
+def colourMapFromList(entries):
+    return {(r, g, b): (tr, tg, tb) for (r, g, b, tr, tg, tb) in entries}
+
+# everything the JSON and sheet generators read, after deduplication and palette calculation
+def spellToDict(spell):
+
+    return {
+        "name": spell.name,
+        "globalCommandsOnHit": spell.globalCommandsOnHit,
+        "globalCommandsOnMiss": spell.globalCommandsOnMiss,
+        "foregroundUpdates": list(spell.foregroundUpdates),
+        "foregroundUpdatesAfterHit": list(spell.foregroundUpdatesAfterHit),
+        "backgroundUpdates": list(spell.backgroundUpdates),
+        "backgroundUpdatesAfterHit": list(spell.backgroundUpdatesAfterHit),
+        "foregroundImages": spell.foregroundImages,
+        "backgroundImages": spell.backgroundImages,
+        "stretchForeground": spell.stretchForeground,
+        "skipBackground": spell.skipBackground,
+        "foregroundImageHeight": spell.foregroundImageHeight,
+        "foregroundPaletteData": paletteToList(spell.foregroundPaletteData),
+        "backgroundPaletteData": paletteToList(spell.backgroundPaletteData),
+        "foregroundColourMap": colourMapToList(spell.foregroundColourMap),
+        "quantizationError": spell.quantizationError,
+        "duplicateFramesRemoved": spell.duplicateFramesRemoved,
+        "missingSounds": spell.missingSounds
+    }
+
+def spellFromDict(data):
+
+    # commands and missing sounds are tuples in a freshly parsed spell, JSON turns them into lists
+    spell = Spell(
+        data["name"],
+        [Command(*command) for command in data["globalCommandsOnHit"]],
+        [Command(*command) for command in data["globalCommandsOnMiss"]],
+        Timeline(data["foregroundUpdates"]),
+        Timeline(data["foregroundUpdatesAfterHit"]),
+        Timeline(data["backgroundUpdates"]),
+        Timeline(data["backgroundUpdatesAfterHit"]),
+        data["foregroundImages"],
+        data["backgroundImages"],
+        data["stretchForeground"]
+    )
+
+    spell.skipBackground = data["skipBackground"]
+    spell.foregroundImageHeight = data["foregroundImageHeight"]
+    spell.foregroundPaletteData = paletteFromList(data["foregroundPaletteData"])
+    spell.backgroundPaletteData = paletteFromList(data["backgroundPaletteData"])
+    spell.foregroundColourMap = colourMapFromList(data["foregroundColourMap"])
+    spell.quantizationError = data["quantizationError"]
+    spell.duplicateFramesRemoved = data["duplicateFramesRemoved"]
+    spell.missingSounds = [tuple(missing) for missing in data["missingSounds"]]
+
+    return spell
+
+# inputs are the hashes of Spell.txt and its frames the state was computed from, as in the manifest,
+# the palette cap it was quantized to and the CONVERTER_VERSION that computed it
+def saveSpell(outputPath, spell, inputs):
+
+    data = json.dumps({"version": IR_VERSION, "inputs": inputs, "spell": spellToDict(spell)}, separators=(",", ":"))
+    irPath = os.path.join(outputPath, IR_NAME)
+
+    with open(irPath + ".tmp", "wb") as irFile:
+        irFile.write(zlib.compress(data.encode(), 6))
+
+    os.replace(irPath + ".tmp", irPath)
+
+    return IR_NAME
+
+# (spell, inputs), or None when there's no usable file
+def loadSpell(outputPath):
+
+    try:
+        with open(os.path.join(outputPath, IR_NAME), "rb") as irFile:
+            data = json.loads(zlib.decompress(irFile.read()))
+
+    except (OSError, ValueError, zlib.error):
+        return None
+
+    if data.get("version") != IR_VERSION:
+        return None
+
+    return (spellFromDict(data["spell"]), data["inputs"])
@@ -0,0 +1,45 @@
+import math
+
+# where each equally sized frame cell goes in a spell's sheet(s)
+class SheetLayout:
+
+    # maxTextureSize of 0 or None keeps the single horizontal strip
+    def __init__(self, cellWidth, cellHeight, frameCount, maxTextureSize=None):
+
+        self.cellWidth = cellWidth
+        self.cellHeight = cellHeight
+        self.frameCount = frameCount
+
+        if not maxTextureSize:
+            self.columns = max(frameCount, 1)
+            self.rows = 1
+
+        else:
+
+            if cellWidth > maxTextureSize or cellHeight > maxTextureSize:
+                raise ValueError("a %dx%d frame doesn't fit in a %d px texture" % (cellWidth, cellHeight, maxTextureSize))
+
+            # near-square sheet: columns * cellWidth ~= rows * cellHeight
+            columns = math.ceil(math.sqrt(frameCount * cellHeight / cellWidth)) if frameCount else 1
+
+            self.columns = max(1, min(columns, maxTextureSize // cellWidth, frameCount))
+            self.rows = max(1, min(math.ceil(frameCount / self.columns), maxTextureSize // cellHeight))
+
+        self.framesPerPage = self.columns * self.rows
+        self.pages = max(1, math.ceil(frameCount / self.framesPerPage))
+
+    # (page, x, y) of frame n
+    def position(self, n):
+
+        (page, cell) = divmod(n, self.framesPerPage)
+        (row, column) = divmod(cell, self.columns)
+
+        return (page, column * self.cellWidth, row * self.cellHeight)
+
+    # (width, height) of a page, the last page only as tall as it needs to be
+    def pageSize(self, page):
+
+        frames = min(self.framesPerPage, self.frameCount - page * self.framesPerPage)
+        rows = max(1, math.ceil(frames / self.columns))
+
+        return (self.columns * self.cellWidth, rows * self.cellHeight)
@@ -1,58 +1,327 @@
 from parse import *
 from spell import *
+from manifest import *
+from profiling import Profiler, NullProfiler
+from soundindex import soundIndex, CATALOG_NAME
+from export import exportToProject, printStats
+from intermediate import saveSpell, loadSpell
+from framecache import addCacheArgument, cacheBytesFromArguments
 
-from PyQt5 import QtGui
+import imagebackends
+import argparse
 import os
 import json
 import shutil
 
-spellName = input("spell name: ")
-animationPath = input("animation path: ")
-outputPath = input("output folder (will be created if it doesn't exist): ")
+# output options, stored in the manifest so changing them forces a rebuild
+DEFAULT_OPTIONS = {
+    # one effect, sheet and palette per layer, playing the Hit and Miss poses
+    "shared": False,
+    # indented JSON instead of compact
+    "pretty": False,
+    # wrap sheets into a grid no wider or taller than this, spilling onto extra sheets; 0 keeps one strip
+    "maxTextureSize": 0,
+    # folder the sounds a spell plays are copied into, relative to its output folder or absolute to share one; "" copies none
+    "soundFolder": "sfx",
+    # 32-bit RGB sheets with the index as the colour (0, g, b) rather than 8-bit indexed ones, for engines reading the PNG bytes directly
+    "rgbSheets": False,
+    # merge the foreground palette down to this many colours when the frames use more; 0 keeps every colour
+    "maxColours": 0
+}
+
+def addOptionArguments(argParser):
+    argParser.add_argument("--shared", action="store_true", help="write one effect per layer with both the Hit and Miss poses, reading one sheet and one palette, instead of separate Hit and Miss effects")
+    argParser.add_argument("--pretty", action="store_true", help="indent the generated JSON")
+    argParser.add_argument("--max-texture-size", dest="maxTextureSize", type=int, default=0, help="pack frames into a near-square grid of at most this many pixels per side, split over several sheets (one child effect each) if needed")
+    argParser.add_argument("--rgb-sheets", dest="rgbSheets", action="store_true", help="write the sheets as RGB with each palette index stored as the colour (0, g, b), as older versions did, instead of 8-bit indexed PNGs")
+    argParser.add_argument("--max-colours", dest="maxColours", type=int, default=0, help="quantize the foreground palette to at most this many colours when the frames use more, e.g. 256 to keep indexed sheets; 0 keeps them all")
+    argParser.add_argument("--sound-folder", dest="soundFolder", default="sfx", help="copy the sounds each spell plays here, relative to its output folder or an absolute path shared by all spells; empty to skip (default: sfx)")
+
+def optionsFromArguments(args):
+    return {option: getattr(args, option) for option in DEFAULT_OPTIONS}
+
+def dumpJSON(outputPath, name, data, pretty=False):
 
-def dumpJSON(name, data):
     with open(os.path.join(outputPath, name + ".json"), "w") as outputFile:
-        json.dump(data, outputFile, indent=4)
 
-def main():
+        if pretty:
+            json.dump(data, outputFile, indent=4)
+
+        else:
+            json.dump(data, outputFile, separators=(",", ":"))
+
+    return name + ".json"
+
+# a layer's effects, more than one when its frames are split over several sheets
+def dumpEffects(outputPath, effects, pretty=False):
+    return [dumpJSON(outputPath, effect["nid"] + "_effect", effect, pretty) for effect in effects]
+
+# the Miss sheets are copies of the Hit sheets, missName is None when one effect plays both and reads one sheet
+# writeSheets(paths) streams the Hit sheets straight to disk, one path per page of layout
+def saveSheets(outputPath, writeSheets, layout, hitName, missName, profiler, layer):
+
+    hitNames = Spell.sheetNames(hitName, layout.pages)
+    missNames = [] if missName is None else Spell.sheetNames(missName, layout.pages)
+
+    with profiler.stage(layer + "Sheet") as record:
+
+        writeSheets([os.path.join(outputPath, name + ".png") for name in hitNames])
+
+        record["sheets"] = layout.pages
+        record["pixels"] = sum(width * height for (width, height) in map(layout.pageSize, range(layout.pages)))
+        record["bytes"] = sum(os.path.getsize(os.path.join(outputPath, name + ".png")) for name in hitNames)
+
+    with profiler.stage(layer + "SheetCopy") as record:
+
+        record["sheets"] = len(missNames)
+
+        for (hitSheet, missSheet) in zip(hitNames, missNames):
+
+            missPath = os.path.join(outputPath, missSheet + ".png")
+
+            # older versions could hard link the Miss sheet to the Hit sheet, copying onto that would fail
+            if os.path.exists(missPath):
+                os.remove(missPath)
+
+            shutil.copyfile(os.path.join(outputPath, hitSheet + ".png"), missPath)
+
+    return [name + ".png" for name in hitNames + missNames]
+
+# copies the spell's sounds next to its outputs, returns the output paths for the manifest
+# a folder outside the output path is shared, so its catalog is merged and its files aren't owned by this spell
+def bundleSounds(spell, outputPath, soundFolder, profiler):
+
+    with profiler.stage("sounds") as record:
+
+        (found, missing) = soundIndex.ensureLoaded().resolve(spell.getReferencedSounds())
+
+        spell.sounds = found
+        spell.missingSoundFiles = missing
+
+        record["sounds"] = len(found)
+        record["missingIDs"] = len(spell.missingSounds)
+        record["missingFiles"] = len(missing)
+        record["copied"] = 0
+
+        if not soundFolder or not found:
+            return []
+
+        shared = os.path.isabs(soundFolder)
+        record["copied"] = soundIndex.bundle(found, os.path.join(outputPath, soundFolder), merge=shared)
+
+        if shared:
+            return []
+
+        return [os.path.join(soundFolder, soundIndex.sounds[name]["file"]) for name in found] + [os.path.join(soundFolder, CATALOG_NAME)]
+
+# returns (spell, status), status is "skipped", "timeline" (JSON only) or "full"; spell is None when skipped
+# pass a profiling.Profiler to time each stage and write <spell>_profile.json next to the outputs
+# bundle=False leaves copying the sounds to the caller, e.g. batch does it once for a shared sound folder
+def convertSpell(spellName, animationPath, outputPath, force=False, profiler=None, options=None, threads=1, bundle=True):
+
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    shared = options["shared"]
+    pretty = options["pretty"]
+
+    report = profiler is not None
+
+    if profiler is None:
+        profiler = NullProfiler()
+
+    spellFilePath = findScript(animationPath)
+
+    with profiler.stage("manifestCheck"):
+        previousManifest = None if force else loadManifest(outputPath)
+        upToDate = isUpToDate(previousManifest, spellFilePath, animationPath, outputPath, options)
+
+    if upToDate:
+        return (None, "skipped")
+
+    # the parsed and scanned state of the last run, usable as long as the script, the frames, the palette cap
+    # and the converter that produced it are unchanged
+    with profiler.stage("loadState") as record:
+        state = None if force else loadSpell(outputPath)
+        loaded = state is not None and state[0].name == spellName and state[1].get("converterVersion") == CONVERTER_VERSION and state[1].get("maxColours", 0) == options["maxColours"] and inputsUnchanged(state[1], spellFilePath, animationPath)
+        record["loaded"] = loaded
+
+    if loaded:
+        spell = state[0]
+
+    else:
+        with profiler.stage("parse") as record:
+            parser = Parser(spellName)
+            spell = parser.parseScript(spellFilePath)
+            record["foregroundUpdates"] = len(spell.foregroundUpdates) + len(spell.foregroundUpdatesAfterHit)
+            record["backgroundUpdates"] = len(spell.backgroundUpdates) + len(spell.backgroundUpdatesAfterHit)
+
+    spell.maxTextureSize = options["maxTextureSize"]
+    spell.frameThreads = threads
+    spell.indexedSheets = not options["rgbSheets"]
 
-    app = QtGui.QGuiApplication([])
+    if not loaded:
 
-    parser = Parser(spellName)
-    spell = parser.parse(os.path.join(animationPath, "Spell.txt"))
+        with profiler.stage("deduplicateFrames", frames=len(spell.foregroundImages) + len(spell.backgroundImages)) as record:
+            record["columnsSaved"] = spell.deduplicateFrames(animationPath)
 
-    spell.calculatePalettes(animationPath)
+        with profiler.stage("calculatePalettes") as record:
+            spell.calculatePalettes(animationPath)
+            record["frames"] = len(spell.foregroundImages) + (0 if spell.skipBackground else len(spell.backgroundImages))
+            record["pixels"] = len(spell.foregroundImages) * SCREEN_WIDTH * (spell.foregroundImageHeight or 0)
+            record["foregroundPaletteSize"] = len(spell.foregroundPaletteData)
+            record["backgroundPaletteSize"] = len(spell.backgroundPaletteData)
+
+        with profiler.stage("quantizePalette") as record:
+
+            error = spell.quantizeForegroundPalette(animationPath, options["maxColours"])
+            record["quantized"] = error is not None
+
+            if error is not None:
+                record.update(error)
+
+    with profiler.stage("manifestBuild"):
+        manifest = buildManifest(spell, spellFilePath, animationPath, options)
+        writeSheets = not sheetsUpToDate(previousManifest, manifest, outputPath)
 
     if not os.path.exists(outputPath):
-        os.mkdir(outputPath)
+        os.makedirs(outputPath)
+
+    def writeForegroundJSON():
+
+        with profiler.stage("foregroundJSON") as record:
+
+            foregroundOutputs = [dumpJSON(outputPath, spell.name + "_effect", spell.generateParentEffectJSON(shared), pretty)]
+
+            if shared:
+                foregroundOutputs += dumpEffects(outputPath, spell.generateForegroundJSON(), pretty)
+                foregroundOutputs.append(dumpJSON(outputPath, spell.name + "FG_Image_palette", spell.generateForegroundPaletteJSON(), pretty))
+
+            else:
+                foregroundOutputs += dumpEffects(outputPath, spell.generateForegroundOnHitJSON(), pretty)
+                foregroundOutputs += dumpEffects(outputPath, spell.generateForegroundOnMissJSON(), pretty)
+                foregroundOutputs.append(dumpJSON(outputPath, spell.name + "FGHit_Image_palette", spell.generateForegroundOnHitPaletteJSON(), pretty))
+                foregroundOutputs.append(dumpJSON(outputPath, spell.name + "FGMiss_Image_palette", spell.generateForegroundOnMissPaletteJSON(), pretty))
+
+            record["files"] = len(foregroundOutputs)
 
-    dumpJSON(spell.name + "_effect", spell.generateParentEffectJSON())
+        return foregroundOutputs
 
-    dumpJSON(spell.name + "FGHit_effect", spell.generateForegroundOnHitJSON())
-    dumpJSON(spell.name + "FGMiss_effect", spell.generateForegroundOnMissJSON())
+    def writeBackgroundJSON():
 
-    dumpJSON(spell.name + "FGHit_Image_palette", spell.generateForegroundOnHitPaletteJSON())
-    dumpJSON(spell.name + "FGMiss_Image_palette", spell.generateForegroundOnMissPaletteJSON())
+        with profiler.stage("backgroundJSON") as record:
 
-    fgHitPath = os.path.join(outputPath, spell.name + "FGHit.png")
-    fgMissPath = os.path.join(outputPath, spellName + "FGMiss.png")
+            if shared:
+                backgroundOutputs = dumpEffects(outputPath, spell.generateBackgroundJSON(), pretty)
+                backgroundOutputs.append(dumpJSON(outputPath, spell.name + "BG_Image_palette", spell.generateBackgroundPaletteJSON(), pretty))
 
-    spell.getForegroundSheet(animationPath).save(fgHitPath)
-    shutil.copyfile(fgHitPath, fgMissPath)
+            else:
+                backgroundOutputs = dumpEffects(outputPath, spell.generateBackgroundOnHitJSON(), pretty)
+                backgroundOutputs += dumpEffects(outputPath, spell.generateBackgroundOnMissJSON(), pretty)
+                backgroundOutputs.append(dumpJSON(outputPath, spell.name + "BGHit_Image_palette", spell.generateBackgroundOnHitPaletteJSON(), pretty))
+                backgroundOutputs.append(dumpJSON(outputPath, spell.name + "BGMiss_Image_palette", spell.generateBackgroundOnMissPaletteJSON(), pretty))
+
+            record["files"] = len(backgroundOutputs)
+
+        return backgroundOutputs
+
+    # (Hit, Miss) sheet names of a layer, no Miss copies when one effect plays both outcomes
+    def layerSheets(layer):
+        return (spell.name + layer, None) if shared else (spell.name + layer + "Hit", spell.name + layer + "Miss")
+
+    # (outputs, sheet outputs) tasks; the sheets, JSON and sounds don't depend on each other
+    tasks = [lambda: (writeForegroundJSON(), [])]
+
+    if writeSheets:
+        tasks.append(lambda: ([], saveSheets(outputPath, lambda paths: spell.writeForegroundSheets(animationPath, paths), spell.getForegroundLayout(), *layerSheets("FG"), profiler, "foreground")))
 
     if not spell.skipBackground:
 
-        dumpJSON(spell.name + "BGHit_effect", spell.generateBackgroundOnHitJSON())
-        dumpJSON(spell.name + "BGMiss_effect", spell.generateBackgroundOnMissJSON())
+        tasks.append(lambda: (writeBackgroundJSON(), []))
+
+        if writeSheets:
+            tasks.append(lambda: ([], saveSheets(outputPath, lambda paths: spell.writeBackgroundSheets(animationPath, paths), spell.getBackgroundLayout(), *layerSheets("BG"), profiler, "background")))
+
+    tasks.append(lambda: (bundleSounds(spell, outputPath, options["soundFolder"] if bundle else "", profiler), []))
+
+    # run side by side when there are threads to spare; a profiled run keeps them apart so each stage is measured alone
+    outputs = []
+
+    for (taskOutputs, sheetOutputs) in mapFrames(lambda task: task(), tasks, 1 if report else threads):
+        outputs += taskOutputs
+        manifest["sheetOutputs"] += sheetOutputs
+
+    if not writeSheets:
+        manifest["sheetOutputs"] = previousManifest["sheetOutputs"]
+
+    manifest["sounds"] = spell.sounds
+
+    with profiler.stage("manifestSave"):
+
+        outputs.append(saveSpell(outputPath, spell, {"spell": manifest["spell"], "frames": manifest["frames"], "maxColours": options["maxColours"], "converterVersion": CONVERTER_VERSION}))
+
+        # written once this stage is timed, listed now so a later run without --profile removes it
+        if report:
+            outputs.append(spell.name + "_profile.json")
+
+        manifest["outputs"] = outputs + manifest["sheetOutputs"]
+        saveManifest(outputPath, manifest)
+
+        # files only the previous options produced, e.g. per-effect palettes after switching to --shared
+        if previousManifest is not None:
+            for output in set(previousManifest.get("outputs", [])) - set(manifest["outputs"]):
+                if os.path.exists(os.path.join(outputPath, output)):
+                    os.remove(os.path.join(outputPath, output))
+
+    if report:
+        with open(os.path.join(outputPath, spell.name + "_profile.json"), "w") as reportFile:
+            json.dump(profiler.report(), reportFile, indent=4)
+
+    return (spell, "full" if writeSheets else "timeline")
+
+def printQuantization(error):
+    print("foreground palette quantized from %(colours)d to %(paletteColours)d colours, %(pixelsChanged)d pixel(s) changed, mean error %(meanError).2f, max %(maxError).2f" % error)
+
+def main():
+
+    argParser = argparse.ArgumentParser(description="Convert a single spell, prompting for its name and folders.")
+    argParser.add_argument("--profile", action="store_true", help="write a per-stage timing and memory report next to the outputs")
+    addOptionArguments(argParser)
+    imagebackends.addBackendArgument(argParser)
+    addCacheArgument(argParser)
+    argParser.add_argument("-t", "--threads", type=int, default=os.cpu_count(), help="threads used to decode and palettize frames (default: CPU count)")
+    argParser.add_argument("--project", help="also merge the spell into this Lex Talionis project's combat effect and palette catalogs")
+    args = argParser.parse_args()
+
+    spellName = input("spell name: ")
+    animationPath = input("animation path: ")
+    outputPath = input("output folder (will be created if it doesn't exist): ")
+
+    imagebackends.setBackend(args.backend)
+    frameCache.setBudget(cacheBytesFromArguments(args))
+
+    profiler = Profiler(spellName) if args.profile else None
+    (spell, status) = convertSpell(spellName, animationPath, outputPath, profiler=profiler, options=optionsFromArguments(args), threads=args.threads)
+
+    if args.project:
+        printStats(exportToProject(args.project, [outputPath]))
+
+    if status == "skipped":
+        print("inputs unchanged since the last conversion, nothing to do")
+        return
+
+    if status == "timeline":
+        print("frames unchanged, sheets left as they were")
+
+    print("removed %d duplicate frame(s) from the sheets" % spell.duplicateFramesRemoved)
+    print("%d sound(s) bundled" % len(spell.sounds))
 
-        dumpJSON(spell.name + "BGHit_Image_palette", spell.generateBackgroundOnHitPaletteJSON())
-        dumpJSON(spell.name + "BGMiss_Image_palette", spell.generateBackgroundOnMissPaletteJSON())
+    if spell.quantizationError is not None:
+        printQuantization(spell.quantizationError)
 
-        bgHitPath = os.path.join(outputPath, spell.name + "BGHit.png")
-        bgMissPath = os.path.join(outputPath, spellName + "BGMiss.png")
+    for (lineNumber, soundID) in spell.missingSounds:
+        print("line %d: no sound for ID 0x%X, the command was skipped" % (lineNumber, soundID))
 
-        spell.getBackgroundSheet(animationPath).save(bgHitPath)
-        shutil.copyfile(bgHitPath, bgMissPath)
+    for name in spell.missingSoundFiles:
+        print("sound %s isn't in the sfx folder" % name)
 
 if __name__ == "__main__":
     main()
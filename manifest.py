@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+
+# bump whenever a change alters the generated JSON or sheets, so old outputs get rebuilt
+CONVERTER_VERSION = 7
+
+MANIFEST_NAME = "manifest.json"
+
+# the options that change the sheets themselves; shared decides whether there are Miss sheets at all
+SHEET_OPTIONS = ["maxTextureSize", "rgbSheets", "maxColours", "shared"]
+
+def hashFile(path):
+
+    contentHash = hashlib.blake2b()
+
+    with open(path, "rb") as inputFile:
+        for chunk in iter(lambda: inputFile.read(1 << 20), b""):
+            contentHash.update(chunk)
+
+    return contentHash.hexdigest()
+
+def loadManifest(outputPath):
+
+    try:
+        with open(os.path.join(outputPath, MANIFEST_NAME)) as manifestFile:
+            return json.load(manifestFile)
+
+    except (OSError, ValueError):
+        return None
+
+def saveManifest(outputPath, manifest):
+
+    # write then rename so an interrupted run never leaves a manifest claiming outputs are current
+    manifestPath = os.path.join(outputPath, MANIFEST_NAME)
+
+    with open(manifestPath + ".tmp", "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent=4)
+
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+def outputsExist(outputPath, outputs):
+    return all(os.path.exists(os.path.join(outputPath, output)) for output in outputs)
+
+# inputs holds the "spell" and "frames" hashes recorded by a previous run
+def inputsUnchanged(inputs, spellFilePath, animationPath):
+
+    if inputs["spell"] != hashFile(spellFilePath):
+        return False
+
+    for (frame, frameHash) in inputs["frames"].items():
+
+        framePath = os.path.join(animationPath, frame)
+
+        if not os.path.exists(framePath) or hashFile(framePath) != frameHash:
+            return False
+
+    return True
+
+# checked before parsing, using the frame list recorded by the previous run
+def isUpToDate(manifest, spellFilePath, animationPath, outputPath, options):
+
+    if manifest is None or manifest.get("version") != CONVERTER_VERSION or manifest.get("options") != options:
+        return False
+
+    return inputsUnchanged(manifest, spellFilePath, animationPath) and outputsExist(outputPath, manifest["outputs"])
+
+def buildManifest(spell, spellFilePath, animationPath, options):
+
+    frames = {}
+
+    for frame in list(spell.foregroundImages) + list(spell.backgroundImages):
+        if frame not in frames:
+            frames[frame] = hashFile(os.path.join(animationPath, frame))
+
+    # everything the sheets depend on; the timing in Spell.txt doesn't affect them
+    sheetInputs = [
+        CONVERTER_VERSION,
+        [[frame, frames[frame], nid] for (frame, nid) in spell.foregroundImages.items()],
+        [[frame, frames[frame], nid] for (frame, nid) in spell.backgroundImages.items()],
+        spell.stretchForeground,
+        spell.skipBackground,
+        {option: options.get(option) for option in SHEET_OPTIONS}
+    ]
+
+    return {
+        "version": CONVERTER_VERSION,
+        "options": options,
+        "spell": hashFile(spellFilePath),
+        "frames": frames,
+        "sheets": hashlib.blake2b(json.dumps(sheetInputs).encode()).hexdigest(),
+        "sheetOutputs": [],
+        "outputs": []
+    }
+
+def sheetsUpToDate(previousManifest, manifest, outputPath):
+
+    if previousManifest is None or previousManifest.get("version") != CONVERTER_VERSION:
+        return False
+
+    return previousManifest["sheets"] == manifest["sheets"] and outputsExist(outputPath, previousManifest["sheetOutputs"])
@@ -1,42 +1,220 @@
 from spell import *
 from sound import *
+from timeline import Timeline, Command
+import mmap
+import os
+import struct
 
-class Parser:
+# a compiled script is a stream of little-endian 32-bit words, the records the text dump spells out:
+#   0x85AABBCC          command CC with arguments AA and BB, the text's CAABBCC
+#   0x86000000 | n      frame shown for n frames, followed by the 8 pointers of FRAME_POINTERS
+#   0x80000000          miss terminator, the text's ~
+COMMAND_RECORD = 0x85
+FRAME_RECORD = 0x86
+MISS_TERMINATOR = 0x80000000
+
+# the ROM pointers after a frame's first word, in order; the OAM and TSA data (one copy per facing) and the
+# palettes are rebuilt by the converter, so only the OBJ (foreground) and BG (background) graphics are read
+FRAME_POINTERS = [
+    "objGraphics",
+    "objOAMRightToLeft",
+    "objOAMLeftToRight",
+    "bgGraphics",
+    "bgTSARightToLeft",
+    "bgTSALeftToRight",
+    "objPalette",
+    "bgPalette"
+]
+
+FRAME_WORDS = 1 + len(FRAME_POINTERS)
+FRAME_FOREGROUND_WORD = 1 + FRAME_POINTERS.index("objGraphics")
+FRAME_BACKGROUND_WORD = 1 + FRAME_POINTERS.index("bgGraphics")
+
+# a spell folder holds one of these, the text dump preferred
+SCRIPT_NAMES = ["Spell.txt", "Spell.bin"]
+
+def findScript(animationPath):
+
+    for name in SCRIPT_NAMES:
+        if os.path.exists(os.path.join(animationPath, name)):
+            return os.path.join(animationPath, name)
+
+    return os.path.join(animationPath, SCRIPT_NAMES[0])
+
+# the frames of a compiled script are the graphics exported one PNG per ROM offset
+def defaultImageName(offset):
+    return "%08X.png" % offset
+
+# lineNumber is a byte offset for compiled scripts
+class SpellParseError(Exception):
+
+    def __init__(self, lineNumber, message, location="line %d"):
+        super().__init__((location + ": %s") % (lineNumber, message))
+        self.lineNumber = lineNumber
+
+def parseCommand(lineNumber, line):
+
+    command = line.split(" ")[0]
+
+    try:
+
+        commandNum = int(command[-2:], 16)
+        arg1 = 0
+        arg2 = 0
+
+        if len(command) > 3:
+            arg2 = int(command[-4:-2], 16)
+
+            if len(command) > 5:
+                arg1 = int(command[-6:-4], 16)
+
+    except ValueError:
+        raise SpellParseError(lineNumber, "malformed command %r" % command) from None
+
+    return (commandNum, arg1, arg2)
+
+def nextLine(lines, recordLineNumber, expected):
+
+    try:
+        return next(lines)
+
+    except StopIteration:
+        raise SpellParseError(recordLineNumber, "frame record ends before its %s" % expected) from None
+
+# single forward pass over the script, yields (line number, record type, data) for C, O and ~ records
+def readRecords(lines):
+
+    lines = enumerate((line.strip() for line in lines), 1)
+
+    for (lineNumber, line) in lines:
+
+        if line == "":
+            continue
+
+        match line[0]:
+
+            # comment
+            case "#":
+                pass
+
+            # command
+            case "C":
+                yield (lineNumber, "C", parseCommand(lineNumber, line))
+
+            # update images, background on this line then foreground and duration on the next two
+            case "O":
+
+                backgroundImage = line.split(" ")[-1]
+                foregroundImage = nextLine(lines, lineNumber, "foreground image")[1].split(" ")[-1]
+                (durationLineNumber, durationLine) = nextLine(lines, lineNumber, "duration")
+
+                try:
+                    duration = int(durationLine)
+
+                except ValueError:
+                    raise SpellParseError(durationLineNumber, "expected a frame duration, got %r" % durationLine) from None
+
+                yield (lineNumber, "O", (foregroundImage, backgroundImage, duration))
+
+            # miss terminator
+            case "~":
+                yield (lineNumber, "~", None)
+
+            # ???
+            case _:
+                pass
+
+# the same records as readRecords from a compiled script, without copying the buffer; a word's byte offset stands in for the line number
+def readBinaryRecords(buffer, imageName=defaultImageName):
+
+    view = memoryview(buffer).cast("B")
 
-    globalCommandsOnHit = []
-    globalCommandsOnMiss = []
-    
-    foregroundUpdates = []
-    foregroundUpdatesAfterHit = []
-    backgroundUpdates = []
-    backgroundUpdatesAfterHit = []
+    try:
+        yield from readBinaryWords(view, imageName)
 
-    foregroundImages = {}
-    backgroundImages = {}
+    # a mapped file can't be closed while a view of it is alive
+    finally:
+        view.release()
 
-    currentDimness = 0
-    currentDimnessChange = None
+def readBinaryWords(view, imageName):
 
-    currentForeground = None
-    currentBackground = None
+    if len(view) % 4 != 0:
+        raise SpellParseError(len(view) - len(view) % 4, "script ends partway through a word", "offset 0x%X")
 
-    lastForegroundChange = 0
-    lastBackgroundChange = 0
+    offset = 0
 
-    stretchForeground = False
+    while offset < len(view):
 
-    currentFrame = 0
-    foundMissTerminator = False
-    hasPanned = True
+        (word,) = struct.unpack_from("<I", view, offset)
+        recordType = word >> 24
+
+        if word == MISS_TERMINATOR:
+            yield (offset, "~", None)
+
+        elif recordType == COMMAND_RECORD:
+            yield (offset, "C", (word & 0xFF, word >> 16 & 0xFF, word >> 8 & 0xFF))
+
+        elif recordType == FRAME_RECORD:
+
+            if offset + 4 * FRAME_WORDS > len(view):
+                raise SpellParseError(offset, "frame record ends before its %d words" % FRAME_WORDS, "offset 0x%X")
+
+            (foreground,) = struct.unpack_from("<I", view, offset + 4 * FRAME_FOREGROUND_WORD)
+            (background,) = struct.unpack_from("<I", view, offset + 4 * FRAME_BACKGROUND_WORD)
+
+            yield (offset, "O", (imageName(foreground), imageName(background), word & 0xFFFF))
+
+            offset += 4 * (FRAME_WORDS - 1)
+
+        else:
+            raise SpellParseError(offset, "unknown record 0x%08X" % word, "offset 0x%X")
+
+        offset += 4
+
+class Parser:
 
     def __init__(self, spellName):
         self.spellName = spellName
+        self.reset()
+
+    # all parse state is per-instance so a parser (or many, across threads) can be reused freely
+    def reset(self):
+
+        self.globalCommandsOnHit = []
+        self.globalCommandsOnMiss = []
+
+        self.foregroundUpdates = Timeline()
+        self.foregroundUpdatesAfterHit = Timeline()
+        self.backgroundUpdates = Timeline()
+        self.backgroundUpdatesAfterHit = Timeline()
+
+        self.foregroundImages = {}
+        self.backgroundImages = {}
+
+        self.currentDimness = 0
+        self.currentDimnessChange = None
+
+        self.currentForeground = None
+        self.currentBackground = None
+
+        self.lastForegroundChange = 0
+        self.lastBackgroundChange = 0
+
+        self.stretchForeground = False
+
+        self.currentFrame = 0
+        self.foundMissTerminator = False
+        self.hasPanned = True
+
+        # (line, sound ID) of C48 commands with no SOUND_TABLE entry, skipped and reported instead of failing the spell
+        self.missingSounds = []
+        self.currentLine = 0
 
     def addGlobalCommandOnHit(self, name, parameters=None):
-        self.globalCommandsOnHit.append([self.currentFrame, name, parameters])
+        self.globalCommandsOnHit.append(Command(self.currentFrame, name, parameters))
 
     def addGlobalCommandOnMiss(self, name, parameters=None):
-        self.globalCommandsOnMiss.append([self.currentFrame, name, parameters])
+        self.globalCommandsOnMiss.append(Command(self.currentFrame, name, parameters))
 
     def addGlobalCommand(self, name, parameters=None):
         
@@ -51,10 +229,10 @@ class Parser:
             return
         
         if self.foundMissTerminator:
-            self.foregroundUpdatesAfterHit.append((self.currentForeground, self.currentFrame - self.lastForegroundChange))
+            self.foregroundUpdatesAfterHit.append(self.currentForeground, self.currentFrame - self.lastForegroundChange)
 
         else:
-            self.foregroundUpdates.append((self.currentForeground, self.currentFrame - self.lastForegroundChange))
+            self.foregroundUpdates.append(self.currentForeground, self.currentFrame - self.lastForegroundChange)
 
         self.lastForegroundChange = self.currentFrame
 
@@ -64,10 +242,10 @@ class Parser:
             return
 
         if self.foundMissTerminator:
-            self.backgroundUpdatesAfterHit.append((self.currentBackground, self.currentFrame - self.lastBackgroundChange))
+            self.backgroundUpdatesAfterHit.append(self.currentBackground, self.currentFrame - self.lastBackgroundChange)
 
         else:
-            self.backgroundUpdates.append((self.currentBackground, self.currentFrame - self.lastBackgroundChange))
+            self.backgroundUpdates.append(self.currentBackground, self.currentFrame - self.lastBackgroundChange)
 
         self.lastBackgroundChange = self.currentFrame
 
@@ -95,123 +273,136 @@ class Parser:
         if newBackground != self.currentBackground:
             self.updateBackground(newBackground)
 
-    def parse(self, spellFilePath):
+    def handleCommand(self, commandNum, arg1, arg2):
 
-        with open(spellFilePath) as spell_file:
+        match commandNum:
 
-            lines = list(reversed([line.strip() for line in spell_file.readlines()]))
+            # Attack (becomes critical automatically) with HP stealing
+            case 0x08:
+                pass
+            
+            # 0x14 through 0x28 - passed to attacker's animation;
 
-            while len(lines):
+            case 0x1F:
+                self.addGlobalCommandOnHit("spell_hit")
+                self.addGlobalCommandOnMiss("miss")
 
-                line = lines.pop()
+            # set brightness and opacity levels
+            case 0x29:
 
-                if line == "":
-                    continue
+                dimness = arg1 / 0x10
+                opacity = 1.0 - (arg2 / 0x10 / 2)
 
-                match line[0]:
-                
-                    # comment
-                    case "#":
-                        pass
+                # assume if brightness changes, we are changing fully
+                if dimness < self.currentDimness and self.currentDimnessChange != -1:
+                    self.currentDimnessChange = -1
+                    self.addGlobalCommand("lighten")
 
-                    # command
-                    case "C":
+                elif dimness > self.currentDimness and self.currentDimnessChange != 1:
+                    self.currentDimnessChange = 1
+                    self.addGlobalCommand("darken")
 
-                        command = line.split(" ")[0]
+                self.currentDimness = dimness
 
-                        commandNum = int(command[-2:], 16)
-                        arg1 = 0
-                        arg2 = 0
+            # Sets whether maps 2 and 3 of the GBA screen should be visible.
+            case 0x2A:
+                displayMaps = arg2 != 0
 
-                        if len(command) > 3:
-                            arg2 = int(command[-4:-2], 16)
+            # 0x2B through 0x3F - passed to attacker's animation
 
-                            if len(command) > 5:
-                                arg1 = int(command[-6:-4], 16)
+            # Scrolls the screen from being centered on the attacker to being centered on the defender.
+            # This should not be used more than once per animation.
+            case 0x40:
+                self.addGlobalCommand("pan")
+                self.hasPanned = True
 
-                        match commandNum:
+            # 0x41 through 0x47 - passed to attacker's animation
 
-                            # Attack (becomes critical automatically) with HP stealing
-                            case 0x08:
-                                pass
-                            
-                            # 0x14 through 0x28 - passed to attacker's animation;
+            # Plays sound or music whose ID corresponds to those documented in Music List.txt of the Nightmare module packages.
+            case 0x48:
+                soundID = arg1 * 256 + arg2
 
-                            case 0x1F:
-                                self.addGlobalCommandOnHit("spell_hit")
-                                self.addGlobalCommandOnMiss("miss")
+                if soundID in SOUND_TABLE:
+                    self.addGlobalCommand("sound", [SOUND_TABLE[soundID]])
 
-                            # set brightness and opacity levels
-                            case 0x29:
-        
-                                dimness = arg1 / 0x10
-                                opacity = 1.0 - (arg2 / 0x10 / 2)
+                else:
+                    self.missingSounds.append((self.currentLine, soundID))
+
+            # 0x49 through 0x52 - passed to attacker's animation
+
+            # enable screen stretch - assume used for entire animation
+            case 0x53:
+                self.stretchForeground = True
+
+            # unused
+            case _:
+                pass
+
+    # text or compiled, by extension
+    def parseScript(self, spellFilePath):
 
-                                # assume if brightness changes, we are changing fully
-                                if dimness < self.currentDimness and self.currentDimnessChange != -1:
-                                    self.currentDimnessChange = -1
-                                    self.addGlobalCommand("lighten")
+        if spellFilePath.endswith(".bin"):
+            return self.parseBinary(spellFilePath)
 
-                                elif dimness > self.currentDimness and self.currentDimnessChange != 1:
-                                    self.currentDimnessChange = 1
-                                    self.addGlobalCommand("darken")
+        return self.parse(spellFilePath)
 
-                                self.currentDimness = dimness
+    def parse(self, spellFilePath):
+
+        with open(spellFilePath) as spellFile:
+            return self.parseRecords(readRecords(spellFile))
+
+    # source is a path, mapped rather than read, or any bytes-like object
+    def parseBinary(self, source, imageName=defaultImageName):
+
+        if not isinstance(source, (str, os.PathLike)):
+            return self.parseRecords(readBinaryRecords(source, imageName))
+
+        with open(source, "rb") as spellFile:
 
-                            # Sets whether maps 2 and 3 of the GBA screen should be visible.
-                            case 0x2A:
-                                displayMaps = arg2 != 0
+            # an empty file can't be mapped
+            if os.fstat(spellFile.fileno()).st_size == 0:
+                return self.parseRecords(iter(()))
 
-                            # 0x2B through 0x3F - passed to attacker's animation
+            with mmap.mmap(spellFile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
 
-                            # Scrolls the screen from being centered on the attacker to being centered on the defender.
-                            # This should not be used more than once per animation.
-                            case 0x40:
-                                self.addGlobalCommand("pan")
-                                self.hasPanned = True
+                records = readBinaryRecords(buffer, imageName)
 
-                            # 0x41 through 0x47 - passed to attacker's animation
+                try:
+                    return self.parseRecords(records)
 
-                            # Plays sound or music whose ID corresponds to those documented in Music List.txt of the Nightmare module packages.
-                            case 0x48:
-                                soundID = arg1 * 256 + arg2
-                                self.addGlobalCommand("sound", [SOUND_TABLE[soundID]])
+                finally:
+                    records.close()
 
-                            # 0x49 through 0x52 - passed to attacker's animation
+    # builds the spell from (line, record type, data) records, whichever format they came from
+    def parseRecords(self, records):
 
-                            # enable screen stretch - assume used for entire animation
-                            case 0x53:
-                                self.stretchForeground = True
+        self.reset()
 
-                            # unused
-                            case _:
-                                pass
-                            
+        for (lineNumber, record, data) in records:
 
-                    # update images
-                    case "O":
-                        
-                        backgroundImage = line.split(" ")[-1]
-                        foregroundImage = lines.pop().split(" ")[-1]
-                        duration = int(lines.pop())
+            self.currentLine = lineNumber
 
-                        self.tryUpdateDisplay(foregroundImage, backgroundImage)
-                        self.currentFrame += duration
+            match record:
 
-                    # miss terminator        
-                    case "~":
+                case "C":
+                    self.handleCommand(*data)
 
-                        if self.hasPanned:
-                            self.addGlobalCommandOnMiss("pan")
+                case "O":
 
-                        self.flushForeground()
-                        self.flushBackground()
+                    (foregroundImage, backgroundImage, duration) = data
 
-                        self.foundMissTerminator = True
+                    self.tryUpdateDisplay(foregroundImage, backgroundImage)
+                    self.currentFrame += duration
 
-                    # ???
-                    case _:
-                        pass
+                case "~":
+
+                    if self.hasPanned:
+                        self.addGlobalCommandOnMiss("pan")
+
+                    self.flushForeground()
+                    self.flushBackground()
+
+                    self.foundMissTerminator = True
 
         if self.hasPanned:
             self.addGlobalCommandOnHit("pan")
@@ -219,4 +410,7 @@ class Parser:
         self.flushForeground()
         self.flushBackground()
 
-        return Spell(self.spellName, self.globalCommandsOnHit, self.globalCommandsOnMiss, self.foregroundUpdates, self.foregroundUpdatesAfterHit, self.backgroundUpdates, self.backgroundUpdatesAfterHit, self.foregroundImages, self.backgroundImages, self.stretchForeground)
+        spell = Spell(self.spellName, self.globalCommandsOnHit, self.globalCommandsOnMiss, self.foregroundUpdates, self.foregroundUpdatesAfterHit, self.backgroundUpdates, self.backgroundUpdatesAfterHit, self.foregroundImages, self.backgroundImages, self.stretchForeground)
+        spell.missingSounds = self.missingSounds
+
+        return spell
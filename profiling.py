@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+import time
+import tracemalloc
+
+# callables run for every stage of every profiled conversion in this process, with (spell name, stage record)
+hooks = []
+
+def addHook(hook):
+    hooks.append(hook)
+
+def removeHook(hook):
+    hooks.remove(hook)
+
+class Profiler:
+
+    def __init__(self, spellName, extraHooks=()):
+
+        self.spellName = spellName
+        self.stages = []
+        self.hooks = hooks + list(extraHooks)
+
+    # the body can add metrics (pixel counts, palette sizes...) to the yielded dict
+    @contextmanager
+    def stage(self, name, **metrics):
+
+        startedTracing = not tracemalloc.is_tracing()
+
+        if startedTracing:
+            tracemalloc.start()
+
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+        record = {"stage": name}
+        record.update(metrics)
+
+        start = time.perf_counter()
+
+        try:
+            yield record
+
+        finally:
+
+            record["seconds"] = time.perf_counter() - start
+
+            # only memory allocated through Python (numpy included) is seen, not Qt's own buffers
+            record["peakBytes"] = tracemalloc.get_traced_memory()[1] - baseline
+
+            if startedTracing:
+                tracemalloc.stop()
+
+            self.stages.append(record)
+
+            for hook in self.hooks:
+                hook(self.spellName, record)
+
+    def report(self):
+        return {
+            "spell": self.spellName,
+            "seconds": sum(stage["seconds"] for stage in self.stages),
+            "stages": self.stages
+        }
+
+class NullProfiler:
+
+    @contextmanager
+    def stage(self, name, **metrics):
+        yield {}
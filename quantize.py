@@ -0,0 +1,82 @@
+import numpy as np
+
+# rows of the colour/palette distance matrix worked on at once
+DISTANCE_CHUNK = 4096
+
+# (palette, nearest) for colours (n, 3) weighted by counts: at most size palette colours, each one of the
+# input colours, and the palette index every input colour maps to
+# boxes are split at the weighted median of their widest channel, largest weighted spread first
+def medianCut(colours, counts, size):
+
+    colours = np.asarray(colours, np.int64)
+    counts = np.asarray(counts, np.int64)
+
+    # spread of a box along its widest channel, weighted by the pixels in it; single colours can't split
+    def score(box):
+
+        if len(box) < 2:
+            return (-1, 0)
+
+        spread = colours[box].max(axis=0) - colours[box].min(axis=0)
+
+        return (spread.max() * counts[box].sum(), int(np.argmax(spread)))
+
+    boxes = [np.arange(len(colours))]
+    scores = [score(boxes[0])]
+
+    while len(boxes) < size:
+
+        widest = max(range(len(boxes)), key=lambda index: scores[index][0])
+
+        if scores[widest][0] <= 0:
+            break
+
+        box = boxes[widest]
+        channel = scores[widest][1]
+
+        order = box[np.argsort(colours[box, channel], kind="stable")]
+        cumulative = np.cumsum(counts[order])
+
+        # both halves keep at least one colour
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2))
+        split = min(max(split, 1), len(order) - 1)
+
+        boxes[widest:widest + 1] = [order[:split], order[split:]]
+        scores[widest:widest + 1] = [score(order[:split]), score(order[split:])]
+
+    # each box is represented by its member closest to the box's weighted mean, so no new colours appear
+    palette = []
+
+    for box in boxes:
+
+        mean = (colours[box] * counts[box, None]).sum(axis=0) / counts[box].sum()
+        palette.append(colours[box[np.argmin(((colours[box] - mean) ** 2).sum(axis=1))]])
+
+    palette = np.array(palette, np.int64)
+
+    return (palette, nearestColours(colours, palette))
+
+# index of the closest palette colour for every colour, by squared RGB distance
+def nearestColours(colours, palette):
+
+    nearest = np.empty(len(colours), np.int64)
+
+    for start in range(0, len(colours), DISTANCE_CHUNK):
+
+        chunk = colours[start:start + DISTANCE_CHUNK]
+        distances = ((chunk[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)
+        nearest[start:start + DISTANCE_CHUNK] = distances.argmin(axis=1)
+
+    return nearest
+
+# mean and largest RGB distance introduced, per pixel
+def quantizationError(colours, counts, palette, nearest):
+
+    distances = np.sqrt(((np.asarray(colours, np.int64) - palette[nearest]) ** 2).sum(axis=1))
+    counts = np.asarray(counts, np.int64)
+
+    return {
+        "meanError": float((distances * counts).sum() / max(counts.sum(), 1)),
+        "maxError": float(distances.max()) if len(distances) else 0.0,
+        "pixelsChanged": int(counts[distances > 0].sum())
+    }
@@ -0,0 +1,320 @@
+from batch import findSpells, initWorker
+from intermediate import loadSpell
+from parse import findScript, readRecords, readBinaryRecords
+from render import playEffect
+from spell import frameCache, packColour, SCREEN_WIDTH, BACKGROUND_WIDTH, BACKGROUND_HEIGHT
+
+import imagebackends
+import numpy as np
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+GOLDEN_NAME = "golden.json"
+
+# (foreground, background) runs of (image, duration) for the Hit and Miss effects, straight from the script
+def scriptTimelines(animationPath):
+
+    scriptPath = findScript(animationPath)
+
+    if scriptPath.endswith(".bin"):
+        with open(scriptPath, "rb") as scriptFile:
+            records = list(readBinaryRecords(scriptFile.read()))
+
+    else:
+        with open(scriptPath) as scriptFile:
+            records = list(readRecords(scriptFile))
+
+    hit = ([], [])
+    miss = ([], [])
+    missEnded = False
+
+    for (lineNumber, record, data) in records:
+
+        if record == "~":
+            missEnded = True
+
+        elif record == "O":
+
+            (foreground, background, duration) = data
+
+            for (layer, image) in enumerate((foreground, background)):
+
+                hit[layer].append((image, duration))
+
+                if not missEnded:
+                    miss[layer].append((image, duration))
+
+    return (hit, miss)
+
+# (length, a, b) for each stretch of ticks where both run lists show the same pair of items
+def alignRuns(runsA, runsB):
+
+    runsA = [list(run) for run in runsA if run[1] > 0]
+    runsB = [list(run) for run in runsB if run[1] > 0]
+
+    (a, b) = (0, 0)
+
+    while a < len(runsA) and b < len(runsB):
+
+        length = min(runsA[a][1], runsB[b][1])
+        yield (length, runsA[a][0], runsB[b][0])
+
+        runsA[a][1] -= length
+        runsB[b][1] -= length
+
+        a += runsA[a][1] == 0
+        b += runsB[b][1] == 0
+
+# (sorted source colours, colours they became) of a quantized palette, for searchsorted lookups
+def colourMapLookup(colourMap):
+
+    keys = np.array([packColour(colour) for colour in colourMap], np.uint32)
+    values = np.array([packColour(target) for target in colourMap.values()], np.uint32)
+
+    order = np.argsort(keys)
+
+    return (keys[order], values[order])
+
+# what the converter should have put in the sheet for a source frame, cropped and stretched the same way
+# and with merged colours replaced when the palette was quantized; foregroundHeight is the spell's
+# unstretched foreground height, so the frame has its true size whatever rectangle the effect gives it
+def expectedFrame(animationPath, image, background, stretch, foregroundHeight, colourLookup=None):
+
+    pixels = frameCache.get(os.path.join(animationPath, image))
+
+    if background:
+        pixels = pixels[:BACKGROUND_HEIGHT, BACKGROUND_WIDTH - SCREEN_WIDTH - 8:BACKGROUND_WIDTH - 8]
+
+    else:
+        pixels = pixels[:foregroundHeight, :SCREEN_WIDTH]
+
+        if colourLookup is not None:
+            (keys, values) = colourLookup
+            indices = np.minimum(np.searchsorted(keys, pixels), len(keys) - 1)
+            pixels = np.where(keys[indices] == pixels, values[indices], pixels)
+
+        if stretch:
+            pixels = pixels.repeat(2, axis=0)
+
+    return pixels
+
+# effects with a single pose go by their nid alone
+def effectLabel(nid, pose):
+    return nid if pose == "Attack" else "%s %s" % (nid, pose)
+
+def frameDigest(pixels):
+    return hashlib.blake2b(pixels.tobytes(), digest_size=16).hexdigest()
+
+# compares one effect against the source frames tick by tick, returns its report and golden record
+def checkEffect(animationPath, outputPath, nid, pose, sourceRuns, background, stretch, foregroundHeight, colourLookup=None):
+
+    (frames, timeline) = playEffect(outputPath, nid, pose)
+
+    # the trailing wait only holds the last frame until the parent effect ends
+    while timeline and timeline[-1][0] is None:
+        timeline.pop()
+
+    report = {
+        "effect": effectLabel(nid, pose),
+        "ticks": sum(duration for (image, duration) in sourceRuns),
+        "renderedTicks": sum(duration for (frameNid, duration) in timeline),
+        "mismatchedTicks": 0,
+        "mismatchedPixels": 0,
+        "wrongSizeFrames": []
+    }
+
+    # each distinct pairing is compared once however many ticks it covers
+    mismatches = {}
+
+    for (length, frameNid, image) in alignRuns(timeline, sourceRuns):
+
+        if (frameNid, image) not in mismatches:
+
+            if frameNid is None:
+                mismatches[(frameNid, image)] = -1
+
+            else:
+                rendered = frames[frameNid]
+                expected = expectedFrame(animationPath, image, background, stretch, foregroundHeight, colourLookup)
+
+                # a frame rectangle cut short (or overlong) fails outright rather than being compared in part
+                if expected.shape != rendered.shape:
+                    mismatches[(frameNid, image)] = max(rendered.size, expected.size)
+                    report["wrongSizeFrames"].append([frameNid, list(rendered.shape), list(expected.shape)])
+
+                else:
+                    different = rendered != expected
+
+                    # the background palette block is blanked in the sheet
+                    if background:
+                        different[:2, SCREEN_WIDTH - 8:] = False
+
+                    mismatches[(frameNid, image)] = int(different.sum())
+
+        if mismatches[(frameNid, image)] != 0:
+            report["mismatchedTicks"] += length
+            report["mismatchedPixels"] = max(report["mismatchedPixels"], mismatches[(frameNid, image)])
+
+    golden = {
+        "timeline": timeline,
+        "frames": {frameNid: frameDigest(pixels) for (frameNid, pixels) in frames.items()}
+    }
+
+    report["ok"] = report["ticks"] == report["renderedTicks"] and report["mismatchedTicks"] == 0 and not report["wrongSizeFrames"]
+
+    return (report, golden)
+
+# differences from a stored golden record, as readable strings
+def compareGolden(stored, golden):
+
+    differences = []
+
+    if [list(run) for run in stored["timeline"]] != [list(run) for run in golden["timeline"]]:
+        differences.append("timeline changed")
+
+    for frameNid in sorted(set(stored["frames"]) | set(golden["frames"])):
+        if stored["frames"].get(frameNid) != golden["frames"].get(frameNid):
+            differences.append("frame %s changed" % frameNid)
+
+    return differences
+
+def checkSpell(job):
+
+    (animationPath, outputPath, goldenPath, updateGolden) = job
+    spellName = os.path.basename(os.path.normpath(animationPath))
+
+    result = {"path": animationPath, "error": None, "effects": [], "goldenDifferences": []}
+    start = time.perf_counter()
+
+    try:
+        state = loadSpell(outputPath)
+
+        if state is None:
+            raise ValueError("no spell.ir in %s, convert the spell first" % outputPath)
+
+        stretch = state[0].stretchForeground
+        foregroundHeight = state[0].foregroundImageHeight
+        colourLookup = colourMapLookup(state[0].foregroundColourMap) if state[0].foregroundColourMap else None
+        (hit, miss) = scriptTimelines(animationPath)
+
+        # --shared outputs play both outcomes from one effect per layer
+        shared = os.path.exists(os.path.join(outputPath, spellName + "FG_effect.json"))
+        effects = []
+
+        for (index, layer) in enumerate(("FG", "BG")):
+
+            if shared:
+                effects += [(spellName + layer, "Attack", hit[index], index == 1), (spellName + layer, "Miss", miss[index], index == 1)]
+
+            else:
+                effects += [(spellName + layer + "Hit", "Attack", hit[index], index == 1), (spellName + layer + "Miss", "Attack", miss[index], index == 1)]
+
+        # no background effects when the script has no background frames
+        effects = [effect for effect in effects if os.path.exists(os.path.join(outputPath, effect[0] + "_effect.json"))]
+
+        goldens = {}
+
+        for (nid, pose, sourceRuns, background) in effects:
+            (report, goldens[effectLabel(nid, pose)]) = checkEffect(animationPath, outputPath, nid, pose, sourceRuns, background, stretch, foregroundHeight, None if background else colourLookup)
+            result["effects"].append(report)
+
+        if goldenPath is not None:
+
+            if updateGolden:
+                os.makedirs(os.path.dirname(goldenPath), exist_ok=True)
+
+                with open(goldenPath, "w") as goldenFile:
+                    json.dump(goldens, goldenFile, indent=4)
+
+            else:
+                with open(goldenPath) as goldenFile:
+                    stored = json.load(goldenFile)
+
+                for (nid, golden) in goldens.items():
+
+                    if nid not in stored:
+                        result["goldenDifferences"].append("%s: not in the golden outputs" % nid)
+                        continue
+
+                    result["goldenDifferences"] += ["%s: %s" % (nid, difference) for difference in compareGolden(stored[nid], golden)]
+
+    except Exception:
+        result["error"] = traceback.format_exc().strip().splitlines()[-1]
+
+    result["seconds"] = time.perf_counter() - start
+    result["ok"] = result["error"] is None and not result["goldenDifferences"] and all(report["ok"] for report in result["effects"])
+
+    return result
+
+def checkAll(rootPath, outputRoot, goldenRoot=None, updateGolden=False, workers=None, backend="auto"):
+
+    jobs = []
+
+    for animationPath in findSpells(rootPath):
+
+        relativePath = os.path.relpath(animationPath, rootPath)
+        goldenPath = None if goldenRoot is None else os.path.join(goldenRoot, relativePath, GOLDEN_NAME)
+
+        jobs.append((animationPath, os.path.join(outputRoot, relativePath), goldenPath, updateGolden))
+
+    with multiprocessing.Pool(workers, initializer=initWorker, initargs=(None, backend)) as pool:
+        return pool.map(checkSpell, jobs, chunksize=1)
+
+def printResults(results):
+
+    for result in results:
+
+        print("%-8s %7.2fs  %s" % ("ok" if result["ok"] else "FAILED", result["seconds"], result["path"]))
+
+        if result["error"] is not None:
+            print("          " + result["error"])
+
+        for report in result["effects"]:
+
+            if report["ticks"] != report["renderedTicks"]:
+                print("          %s: %d ticks rendered, the script has %d" % (report["effect"], report["renderedTicks"], report["ticks"]))
+
+            for (frameNid, renderedShape, expectedShape) in report["wrongSizeFrames"][:3]:
+                print("          %s: frame %s is %dx%d, the source frame is %dx%d" % (report["effect"], frameNid, renderedShape[1], renderedShape[0], expectedShape[1], expectedShape[0]))
+
+            if len(report["wrongSizeFrames"]) > 3:
+                print("          %s: and %d more frame(s) of the wrong size" % (report["effect"], len(report["wrongSizeFrames"]) - 3))
+
+            if report["mismatchedTicks"]:
+                print("          %s: %d of %d ticks differ from the source frames, up to %d pixels" % (report["effect"], report["mismatchedTicks"], report["ticks"], report["mismatchedPixels"]))
+
+        for difference in result["goldenDifferences"][:10]:
+            print("          golden: " + difference)
+
+        if len(result["goldenDifferences"]) > 10:
+            print("          golden: and %d more" % (len(result["goldenDifferences"]) - 10))
+
+    print()
+    print("%d of %d spells match" % (sum(result["ok"] for result in results), len(results)))
+
+def main():
+
+    argParser = argparse.ArgumentParser(description="Render converted spells headlessly and check them against their source frames and stored golden outputs.")
+    argParser.add_argument("root", help="directory of spell folders, as given to batch.py")
+    argParser.add_argument("output", help="the converted outputs, as written by batch.py")
+    argParser.add_argument("--golden", help="directory of golden outputs to compare the rendered frames with")
+    argParser.add_argument("--update-golden", action="store_true", help="write the rendered frames to --golden instead of comparing")
+    argParser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    imagebackends.addBackendArgument(argParser)
+    args = argParser.parse_args()
+
+    if args.update_golden and args.golden is None:
+        argParser.error("--update-golden needs --golden")
+
+    results = checkAll(args.root, args.output, args.golden, args.update_golden, args.workers, args.backend)
+    printResults(results)
+
+    return 0 if all(result["ok"] for result in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
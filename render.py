@@ -0,0 +1,100 @@
+import imagebackends
+import numpy as np
+import json
+import os
+
+# plays back a converted effect the way the engine would, from its *_effect.json, palette and sheets alone
+
+def loadJSON(outputPath, name):
+
+    with open(os.path.join(outputPath, name + ".json")) as jsonFile:
+        return json.load(jsonFile)
+
+def loadEffect(outputPath, nid):
+    return loadJSON(outputPath, nid + "_effect")
+
+# 0x00GGBB sheet pixel -> 0xRRGGBB, every index the palette doesn't name stays black
+def loadPaletteLookup(outputPath, paletteNid):
+
+    (nid, colours) = loadJSON(outputPath, paletteNid + "_palette")
+    lookup = np.zeros(1 << 16, np.uint32)
+
+    for ([g, b], [red, green, blue]) in colours:
+        lookup[g << 8 | b] = red << 16 | green << 8 | blue
+
+    return lookup
+
+# frame nid -> RGB array, cut out of the effect's sheet and looked up in its palette
+def renderFrames(outputPath, effect):
+
+    lookup = loadPaletteLookup(outputPath, effect["palettes"][0][1])
+    sheet = imagebackends.readImage(os.path.join(outputPath, effect["nid"] + ".png"))
+
+    frames = {}
+
+    for (nid, [x, y, width, height], offset) in effect["frames"]:
+        frames[nid] = lookup[sheet[y:y + height, x:x + width] & 0xFFFF]
+
+    return frames
+
+# (frames, timeline) of an effect's pose, the timeline as (frame nid, duration) runs with None for the ticks a
+# wait shows nothing; the child effects it spawns are drawn over it from the tick they're spawned on
+def playEffect(outputPath, nid, pose="Attack"):
+
+    effect = loadEffect(outputPath, nid)
+    frames = renderFrames(outputPath, effect)
+
+    ticks = []
+    children = []
+
+    for (poseName, commands) in effect["poses"]:
+
+        if poseName != pose:
+            continue
+
+        for (name, parameters) in commands:
+
+            if name == "frame":
+                ticks += [parameters[1]] * parameters[0]
+
+            elif name == "wait":
+                ticks += [None] * parameters[0]
+
+            elif name == "effect":
+                children.append((len(ticks), parameters[0]))
+
+    for (start, child) in children:
+
+        (childFrames, childTimeline) = playEffect(outputPath, child, pose)
+        frames.update(childFrames)
+
+        for (frameNid, duration) in childTimeline:
+
+            if start + duration > len(ticks):
+                ticks += [None] * (start + duration - len(ticks))
+
+            if frameNid is not None:
+                ticks[start:start + duration] = [frameNid] * duration
+
+            start += duration
+
+    timeline = []
+
+    for frameNid in ticks:
+
+        if timeline and timeline[-1][0] == frameNid:
+            timeline[-1] = (frameNid, timeline[-1][1] + 1)
+
+        else:
+            timeline.append((frameNid, 1))
+
+    return (frames, timeline)
+
+# one RGB array (or None) per tick; frames are shared, not copied, between the ticks they're shown for
+def renderTicks(outputPath, nid, pose="Attack"):
+
+    (frames, timeline) = playEffect(outputPath, nid, pose)
+
+    for (frameNid, duration) in timeline:
+        for tick in range(duration):
+            yield None if frameNid is None else frames[frameNid]
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+
+SFX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sfx")
+
+# Lex Talionis' sfx catalog, [nid, tag] per sound
+CATALOG_NAME = "sfx.json"
+
+INDEX_NAME = ".index.json"
+
+# length in seconds from the Vorbis identification header and the granule position of the last Ogg page
+def oggDuration(path):
+
+    with open(path, "rb") as soundFile:
+
+        header = soundFile.read(64)
+
+        if header[:4] != b"OggS" or header[28:35] != b"\x01vorbis":
+            return None
+
+        sampleRate = struct.unpack_from("<I", header, 40)[0]
+
+        soundFile.seek(0, os.SEEK_END)
+        size = soundFile.tell()
+
+        soundFile.seek(max(0, size - 65536))
+        tail = soundFile.read()
+
+    lastPage = tail.rfind(b"OggS")
+
+    if lastPage < 0 or sampleRate == 0:
+        return None
+
+    granule = struct.unpack_from("<q", tail, lastPage + 6)[0]
+
+    return granule / sampleRate
+
+def hashFile(path):
+
+    with open(path, "rb") as soundFile:
+        return hashlib.blake2b(soundFile.read()).hexdigest()
+
+# every .ogg under sfx/, with hashes and durations cached on disk and refreshed when a file's size or mtime changes
+class SoundIndex:
+
+    def __init__(self, sfxPath=SFX_PATH, indexPath=None):
+
+        self.sfxPath = sfxPath
+        self.indexPath = indexPath or os.path.join(sfxPath, INDEX_NAME)
+
+        self.sounds = {}
+        self.tags = {}
+
+    def load(self):
+
+        try:
+            with open(self.indexPath) as indexFile:
+                cached = json.load(indexFile)
+
+        except (OSError, ValueError):
+            cached = {}
+
+        changed = False
+        self.sounds = {}
+
+        for fileName in sorted(os.listdir(self.sfxPath)):
+
+            if not fileName.endswith(".ogg"):
+                continue
+
+            name = fileName[:-4]
+            stat = os.stat(os.path.join(self.sfxPath, fileName))
+            entry = cached.get(name)
+
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+
+                entry = {
+                    "file": fileName,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "hash": hashFile(os.path.join(self.sfxPath, fileName)),
+                    "duration": oggDuration(os.path.join(self.sfxPath, fileName))
+                }
+
+                changed = True
+
+            self.sounds[name] = entry
+
+        if changed or len(cached) != len(self.sounds):
+            # per-process temporary name, batch workers may rebuild the index at the same time
+            temporaryPath = "%s.%d.tmp" % (self.indexPath, os.getpid())
+
+            try:
+                with open(temporaryPath, "w") as indexFile:
+                    json.dump(self.sounds, indexFile)
+
+                os.replace(temporaryPath, self.indexPath)
+
+            # a read-only sfx folder just means rebuilding the index next time
+            except OSError:
+                pass
+
+        try:
+            with open(os.path.join(self.sfxPath, CATALOG_NAME)) as catalogFile:
+                self.tags = {nid: tag for (nid, tag) in json.load(catalogFile)}
+
+        except (OSError, ValueError):
+            self.tags = {}
+
+        return self
+
+    def ensureLoaded(self):
+
+        if not self.sounds:
+            self.load()
+
+        return self
+
+    # (found, missing) names
+    def resolve(self, names):
+
+        found = [name for name in names if name in self.sounds]
+        missing = [name for name in names if name not in self.sounds]
+
+        return (found, missing)
+
+    # copies the named sounds into destination, plus an sfx.json covering them; sounds with identical
+    # content are stored once and hard linked, files already there with the right content are kept
+    # merge keeps the catalog entries of a folder shared by several spells, otherwise it lists just these names
+    def bundle(self, names, destination, merge=False):
+
+        os.makedirs(destination, exist_ok=True)
+
+        copied = 0
+        stored = {}
+
+        for name in names:
+
+            entry = self.sounds[name]
+            targetPath = os.path.join(destination, entry["file"])
+
+            if os.path.exists(targetPath) and os.path.getsize(targetPath) == entry["size"] and hashFile(targetPath) == entry["hash"]:
+                stored.setdefault(entry["hash"], targetPath)
+                continue
+
+            if os.path.lexists(targetPath):
+                os.remove(targetPath)
+
+            if entry["hash"] in stored:
+                try:
+                    os.link(stored[entry["hash"]], targetPath)
+                    continue
+
+                except OSError:
+                    pass
+
+            shutil.copyfile(os.path.join(self.sfxPath, entry["file"]), targetPath)
+            stored[entry["hash"]] = targetPath
+            copied += 1
+
+        self.writeCatalog(destination, names, merge)
+
+        return copied
+
+    def writeCatalog(self, destination, names, merge=False):
+
+        catalogPath = os.path.join(destination, CATALOG_NAME)
+        catalog = {}
+
+        if merge:
+            try:
+                with open(catalogPath) as catalogFile:
+                    catalog = {nid: tag for (nid, tag) in json.load(catalogFile)}
+
+            except (OSError, ValueError):
+                pass
+
+        for name in names:
+            catalog.setdefault(name, self.tags.get(name))
+
+        with open(catalogPath + ".tmp", "w") as catalogFile:
+            json.dump([[nid, tag] for (nid, tag) in sorted(catalog.items())], catalogFile, indent=4)
+
+        os.replace(catalogPath + ".tmp", catalogPath)
+
+# built on first use and reused by every conversion in the process
+soundIndex = SoundIndex()
@@ -1,4 +1,14 @@
-from PyQt5.QtGui import QPixmap, QImage, QColor
+from framecache import FrameCache
+from layout import SheetLayout
+from timeline import mergedRuns
+from quantize import medianCut, quantizationError
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import tempfile
+import threading
+import imagebackends
+import numpy as np
+import hashlib
 import os
 
 SCREEN_WIDTH = 240
@@ -9,6 +19,102 @@ BACKGROUND_HEIGHT = 160
 def wait(n):
     return ["wait", [n]]
 
+def decodeFrame(path):
+    return imagebackends.readImage(path)
+
+# shared by the palette and sheet passes, and across spells converted in the same process
+frameCache = FrameCache(decodeFrame)
+
+# results come back in input order whatever the thread count, so merging them stays deterministic
+def mapFrames(function, items, threads=1):
+
+    if threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    # decoding, hashing and most NumPy work release the GIL, so threads are enough
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(function, items))
+
+PREFETCH_DONE = object()
+
+# bands a sheet's remapping may run ahead of its PNG encoding, each about one frame of pixels
+SHEET_PREFETCH_BANDS = 4
+
+# iterates on a worker thread, staying at most depth items ahead of the consumer so the two overlap
+# without the producer running away; errors are raised in the consumer, and stopping early stops the producer
+def prefetch(iterable, depth=2):
+
+    items = queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(item):
+
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+
+            except queue.Full:
+                pass
+
+    def produce():
+
+        try:
+            for item in iterable:
+
+                put((item, None))
+
+                if stopped.is_set():
+                    break
+
+            put((PREFETCH_DONE, None))
+
+        except BaseException as error:
+            put((PREFETCH_DONE, error))
+
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+
+            (item, error) = items.get()
+
+            if item is PREFETCH_DONE:
+
+                if error is not None:
+                    raise error
+
+                return
+
+            yield item
+
+    finally:
+        stopped.set()
+        producer.join()
+
+def hashFrame(path):
+    pixels = frameCache.get(path)
+    return (pixels.shape, hashlib.blake2b(pixels.tobytes()).digest())
+
+def packColour(colour):
+    return colour[0] << 16 | colour[1] << 8 | colour[2]
+
+def unpackColour(packed):
+    return (int(packed) >> 16 & 0xFF, int(packed) >> 8 & 0xFF, int(packed) & 0xFF)
+
+# distinct colours in the order a column-by-column scan would first see them
+def uniqueColoursInScanOrder(pixels):
+
+    columnMajor = pixels.T.ravel()
+    colours, firstSeen = np.unique(columnMajor, return_index=True)
+
+    return colours[np.argsort(firstSeen)]
+
 class Spell:
 
     def __init__(self, name, globalCommandsOnHit, globalCommandsOnMiss, foregroundUpdates, foregroundUpdatesAfterHit, backgroundUpdates, backgroundUpdatesAfterHit, foregroundImages, backgroundImages, stretchForeground):
@@ -31,61 +137,215 @@ class Spell:
         self.backgroundPaletteData = {}
         self.foregroundPaletteData = {}
 
+        # source colour -> the palette colour it was merged into, empty unless the palette was quantized
+        self.foregroundColourMap = {}
+        self.quantizationError = None
+
         self.foregroundImageHeight = None
+        self.duplicateFramesRemoved = 0
+
+        # largest sheet dimension, frames wrap into a grid and further sheets past it; None keeps one strip
+        self.maxTextureSize = None
+
+        # threads used to decode, scan and remap frames
+        self.frameThreads = 1
+
+        # 8-bit indexed sheets whose palette entries are the (0, g, b) index colours; False writes them as RGB
+        self.indexedSheets = True
+
+        # (line, sound ID) pairs the parser couldn't name
+        self.missingSounds = []
+
+        # names found in the sound index and those that weren't, filled in when the sounds are bundled
+        self.sounds = []
+        self.missingSoundFiles = []
+
         self.skipBackground = len(self.backgroundImages) == 1
 
-    # not all images have palette in top-right, need to iterate every pixel
-    def addForegroundPaletteColours(self, imagePath):
+    # not all images have palette in top-right, need to check every pixel
+    def getForegroundFrameColours(self, imagePath):
+        return uniqueColoursInScanOrder(frameCache.get(imagePath)[:self.foregroundImageHeight, :SCREEN_WIDTH])
+
+    def mergeForegroundColours(self, colours):
+
+        for packed in colours:
+
+            colour = unpackColour(packed)
+
+            if colour not in self.foregroundPaletteData:
+                idx = len(self.foregroundPaletteData)
+                self.foregroundPaletteData[colour] = [idx % 8, int(idx / 8)]
 
-        image = QImage(imagePath)
+    def addForegroundPaletteColours(self, imagePath):
 
         if self.foregroundImageHeight is None:
 
-            self.foregroundImageHeight = image.height()
+            self.foregroundImageHeight = frameCache.get(imagePath).shape[0]
 
             if self.foregroundImageHeight < 80:
                 self.stretchForeground = True
-        
-        for x in range(SCREEN_WIDTH):
-            for y in range(self.foregroundImageHeight):
 
-                colour = image.pixelColor(x, y).getRgb()[:3]
+        self.mergeForegroundColours(self.getForegroundFrameColours(imagePath))
 
-                if colour not in self.foregroundPaletteData:
-                    idx = len(self.foregroundPaletteData)
-                    self.foregroundPaletteData[colour] = [idx % 8, int(idx / 8)]
+    # top-right 8x2 block, each row read right to left
+    def getBackgroundFrameColours(imagePath):
+        return frameCache.get(imagePath)[:2, BACKGROUND_WIDTH - 8:BACKGROUND_WIDTH][:, ::-1].ravel()
 
-    def addBackgroundPaletteColours(self, imagePath):
-        
-        image = QImage(imagePath)
+    def mergeBackgroundColours(self, colours):
 
-        for y in range(0, 2):
-            for x in range(BACKGROUND_WIDTH - 1, BACKGROUND_WIDTH - 9, -1):
+        for packed in colours:
 
-                colour = image.pixelColor(x, y).getRgb()[:3]
+            colour = unpackColour(packed)
                 
-                if colour not in self.backgroundPaletteData:
-                    idx = len(self.backgroundPaletteData)
-                    self.backgroundPaletteData[colour] = [idx % 8, int(idx / 8)]
+            if colour not in self.backgroundPaletteData:
+                idx = len(self.backgroundPaletteData)
+                self.backgroundPaletteData[colour] = [idx % 8, int(idx / 8)]
+
+    def addBackgroundPaletteColours(self, imagePath):
+        self.mergeBackgroundColours(Spell.getBackgroundFrameColours(imagePath))
 
+    # map filenames with identical pixels to one frame, renumbering nids so they stay contiguous
+    def deduplicateImages(images, framesPath, nidPrefix, threads=1):
+
+        nidsByHash = {}
+        dedupedImages = {}
+
+        contentHashes = mapFrames(hashFrame, [os.path.join(framesPath, image) for image in images], threads)
+
+        for (image, contentHash) in zip(images, contentHashes):
+
+            if contentHash not in nidsByHash:
+                nidsByHash[contentHash] = "%s%d" % (nidPrefix, len(nidsByHash))
+
+            dedupedImages[image] = nidsByHash[contentHash]
+
+        return dedupedImages
+
+    # returns the number of sheet columns saved
+    def deduplicateFrames(self, framesPath):
+
+        foregroundCount = len(set(self.foregroundImages.values()))
+        self.foregroundImages = Spell.deduplicateImages(self.foregroundImages, framesPath, self.name + "FG", self.frameThreads)
+        saved = foregroundCount - len(set(self.foregroundImages.values()))
+
+        if not self.skipBackground:
+            backgroundCount = len(set(self.backgroundImages.values()))
+            self.backgroundImages = Spell.deduplicateImages(self.backgroundImages, framesPath, self.name + "BG", self.frameThreads)
+            saved += backgroundCount - len(set(self.backgroundImages.values()))
+
+        self.duplicateFramesRemoved = saved
+
+        return saved
+
+    # sound names played on hit or miss, in first-use order
+    def getReferencedSounds(self):
+
+        sounds = {}
+
+        for (frame, command, parameters) in self.globalCommandsOnHit + self.globalCommandsOnMiss:
+            if command == "sound":
+                sounds.setdefault(parameters[0])
+
+        return list(sounds)
+
+    # one filename per distinct frame nid, in sheet order
+    def uniqueImages(images):
+
+        firstImages = {}
+
+        for (image, nid) in images.items():
+            firstImages.setdefault(nid, image)
+
+        return list(firstImages.values())
+
+    # frames are scanned in parallel but merged in order, so palette indices match a serial scan
     def calculatePalettes(self, framesPath):
 
-        for foregroundImage in self.foregroundImages:
-            self.addForegroundPaletteColours(os.path.join(framesPath, foregroundImage))
+        foregroundPaths = [os.path.join(framesPath, image) for image in self.foregroundImages]
+
+        if foregroundPaths:
+
+            # the first frame sets the height every other frame is cropped to
+            self.addForegroundPaletteColours(foregroundPaths[0])
+
+            for colours in mapFrames(self.getForegroundFrameColours, foregroundPaths[1:], self.frameThreads):
+                self.mergeForegroundColours(colours)
 
         if self.skipBackground:
             return
 
-        for backgroundImage in self.backgroundImages:
-            self.addBackgroundPaletteColours(os.path.join(framesPath, backgroundImage))
+        backgroundPaths = [os.path.join(framesPath, image) for image in self.backgroundImages]
+
+        for colours in mapFrames(Spell.getBackgroundFrameColours, backgroundPaths, self.frameThreads):
+            self.mergeBackgroundColours(colours)
+
+    # pixels of each colour in paletteData over the frames, in paletteData order
+    def countPaletteColours(paths, height, paletteData, threads=1):
 
-    def generateParentEffectJSON(self):
+        lookupKeys, lookupValues = Spell.getPaletteLookupTable(paletteData)
+        slots = np.zeros(len(lookupKeys), np.int64)
+
+        def countColours(path):
+            return np.unique(frameCache.get(path)[:height, :SCREEN_WIDTH], return_counts=True)
+
+        for (colours, counts) in mapFrames(countColours, paths, threads):
+            np.add.at(slots, np.searchsorted(lookupKeys, colours), counts)
+
+        # back from sorted key order to palette order
+        packed = np.array([packColour(colour) for colour in paletteData], np.uint32)
+
+        return slots[np.searchsorted(lookupKeys, packed)]
+
+    # merges foreground colours down to maxColours with a median cut weighted by pixel count, keeping
+    # slot order by first use; returns the error introduced, or None when the palette already fits
+    def quantizeForegroundPalette(self, framesPath, maxColours):
+
+        if not maxColours or len(self.foregroundPaletteData) <= maxColours:
+            return None
+
+        paths = [os.path.join(framesPath, image) for image in Spell.uniqueImages(self.foregroundImages)]
+
+        colours = np.array(list(self.foregroundPaletteData), np.int64)
+        counts = Spell.countPaletteColours(paths, self.foregroundImageHeight, self.foregroundPaletteData, self.frameThreads)
+
+        (palette, nearest) = medianCut(colours, counts, maxColours)
+
+        self.quantizationError = quantizationError(colours, counts, palette, nearest)
+        self.quantizationError["colours"] = len(colours)
+        self.quantizationError["paletteColours"] = len(palette)
+
+        self.foregroundPaletteData = {}
+        self.foregroundColourMap = {}
+
+        for (colour, index) in zip(colours.tolist(), nearest.tolist()):
+
+            target = tuple(palette[index].tolist())
+            self.foregroundColourMap[tuple(colour)] = target
+
+            if target not in self.foregroundPaletteData:
+                idx = len(self.foregroundPaletteData)
+                self.foregroundPaletteData[target] = [idx % 8, int(idx / 8)]
+
+        return self.quantizationError
+
+    # colour -> slot for every colour the foreground frames use, merged colours included
+    def getForegroundRemapData(self):
+
+        if not self.foregroundColourMap:
+            return self.foregroundPaletteData
+
+        return {colour: self.foregroundPaletteData[target] for (colour, target) in self.foregroundColourMap.items()}
+
+    # shared spawns the one effect per layer from generateForegroundJSON and generateBackgroundJSON in both poses
+    def generateParentEffectJSON(self, shared=False):
+
+        (hit, miss) = ("", "") if shared else ("Hit", "Miss")
 
         commandsOnHit = [
             [
                 "effect",
                 [
-                    "%sFGHit" % self.name
+                    "%sFG%s" % (self.name, hit)
                 ]
             ]
         ]
@@ -94,7 +354,7 @@ class Spell:
             [
                 "effect",
                 [
-                    "%sFGMiss" % self.name
+                    "%sFG%s" % (self.name, miss)
                 ]
             ]
         ]
@@ -104,14 +364,14 @@ class Spell:
             commandsOnHit.append([
                 "under_effect",
                 [
-                    "%sBGHit" % self.name
+                    "%sBG%s" % (self.name, hit)
                 ]
             ])
             
             commandsOnMiss.append([
                 "under_effect",
                 [
-                    "%sBGMiss" % self.name
+                    "%sBG%s" % (self.name, miss)
                 ]
             ])
 
@@ -161,92 +421,161 @@ class Spell:
             "palettes": []
         }
     
-    def convertImagesToFrames(images, height):
-        return [
-            [
-                frameName,
-                [n * SCREEN_WIDTH, 0, SCREEN_WIDTH, height],
-                [0, 0]
-            ]
-            for (n, frameName) in enumerate(images.values())
-        ]
-    
-    def generateImageUpdateJSON(self, name, updates, images, height):
+    # one list of frames per sheet, each frame's rectangle within its own sheet
+    def convertImagesToFrames(images, height, layout=None):
 
-        commands = [
-            [
-                "frame",
-                [
-                    waitFrames,
-                    images[newImage]
-                ]
-            ]   
-            for (newImage, waitFrames) in updates
-        ]
+        frameNames = list(dict.fromkeys(images.values()))
 
-        # assume blend, might be wrong for some spells
-        commands.insert(0, ["blend", [True]])
-        commands.append(wait(1))
+        if layout is None:
+            layout = SheetLayout(SCREEN_WIDTH, height, len(frameNames))
 
-        return {
-            "nid": name,
-            "poses": [
-                [
-                    "Attack",
-                    commands
-                ]
-            ],
-            "frames": Spell.convertImagesToFrames(images, height),
-            "palettes": [
-                [
-                    "Image",
-                    "%s_Image" % name
+        pages = [[] for page in range(layout.pages)]
+
+        for (n, frameName) in enumerate(frameNames):
+
+            (page, x, y) = layout.position(n)
+            pages[page].append([frameName, [x, y, SCREEN_WIDTH, height], [0, 0]])
+
+        return pages
+
+    def sheetNames(name, pages):
+        return [name] + ["%s_%d" % (name, page) for page in range(1, pages)]
+
+    def getForegroundLayout(self):
+        cellHeight = 2 * self.foregroundImageHeight if self.stretchForeground else self.foregroundImageHeight
+        return SheetLayout(SCREEN_WIDTH, cellHeight, len(set(self.foregroundImages.values())), self.maxTextureSize)
+
+    def getBackgroundLayout(self):
+        return SheetLayout(SCREEN_WIDTH, BACKGROUND_HEIGHT, len(set(self.backgroundImages.values())), self.maxTextureSize)
+
+    # poses is (pose, runs) pairs, runs being (nid, duration) pairs from timeline.mergedRuns; height is the
+    # frame's height in the sheet, so doubled for a stretched foreground
+    # an effect only reads the sheet named after it, so a layer split over several sheets becomes one effect
+    # per sheet: the first spawns the others, and each shows its own sheet's frames and waits through the rest
+    def generateImageUpdateJSON(self, name, poses, images, height, layout=None):
+
+        pages = Spell.convertImagesToFrames(images, height, layout)
+        names = Spell.sheetNames(name, len(pages))
+
+        poses = [(pose, list(runs)) for (pose, runs) in poses]
+        pageOf = {frame[0]: page for (page, frames) in enumerate(pages) for frame in frames}
+
+        effects = []
+
+        for (page, nid) in enumerate(names):
+
+            effect = {
+                "nid": nid,
+                "poses": [],
+                "frames": pages[page],
+                "palettes": [
+                    [
+                        "Image",
+                        "%s_Image" % name
+                    ]
                 ]
-            ]
-        }
-    
-    def combineUpdates(updates1, updates2):
+            }
 
-        combinedUpdates = updates1 + updates2
+            for (pose, runs) in poses:
 
-        if updates1[-1][0] == updates2[0][0]:
-            combinedUpdates[len(updates1) - 1] = (updates2[0][0], updates1[-1][1] + updates2[0][1])
-            combinedUpdates.pop(len(updates1))
-    
-        return combinedUpdates
+                # assume blend, might be wrong for some spells
+                commands = [["blend", [True]]]
+
+                if page == 0:
+                    commands += [["effect", [child]] for child in names[1:]]
+
+                for (frameNid, waitFrames) in runs:
 
+                    if pageOf[frameNid] == page:
+                        commands.append(["frame", [waitFrames, frameNid]])
+
+                    elif commands[-1][0] == "wait":
+                        commands[-1] = wait(commands[-1][1][0] + waitFrames)
+
+                    else:
+                        commands.append(wait(waitFrames))
+
+                commands.append(wait(1))
+                effect["poses"].append([pose, commands])
+
+            effects.append(effect)
+
+        return effects
+    
     def generateForegroundOnHitJSON(self):
         return self.generateImageUpdateJSON(
             self.name + "FGHit",
-            Spell.combineUpdates(self.foregroundUpdates, self.foregroundUpdatesAfterHit),
+            [("Attack", mergedRuns(self.foregroundImages, self.foregroundUpdates, self.foregroundUpdatesAfterHit))],
             self.foregroundImages,
-            self.foregroundImageHeight
+            self.getForegroundLayout().cellHeight,
+            self.getForegroundLayout()
         )
     
     def generateForegroundOnMissJSON(self):
         return self.generateImageUpdateJSON(
             self.name + "FGMiss",
-            self.foregroundUpdates,
+            [("Attack", mergedRuns(self.foregroundImages, self.foregroundUpdates))],
             self.foregroundImages,
-            self.foregroundImageHeight
+            self.getForegroundLayout().cellHeight,
+            self.getForegroundLayout()
         )
     
     def generateBackgroundOnHitJSON(self):
         return self.generateImageUpdateJSON(
             self.name + "BGHit",
-            Spell.combineUpdates(self.backgroundUpdates, self.backgroundUpdatesAfterHit),
+            [("Attack", mergedRuns(self.backgroundImages, self.backgroundUpdates, self.backgroundUpdatesAfterHit))],
             self.backgroundImages,
-            BACKGROUND_HEIGHT
+            BACKGROUND_HEIGHT,
+            self.getBackgroundLayout()
         )
     
     def generateBackgroundOnMissJSON(self):
         return self.generateImageUpdateJSON(
             self.name + "BGMiss",
-            self.backgroundUpdates,
+            [("Attack", mergedRuns(self.backgroundImages, self.backgroundUpdates))],
             self.backgroundImages,
-            self.foregroundImageHeight
+            BACKGROUND_HEIGHT,
+            self.getBackgroundLayout()
+        )
+
+    # one effect for both outcomes, its Attack and Miss poses drawing on one sheet with the palette from
+    # generateForegroundPaletteJSON; the parent effect plays the pose of the outcome
+    def generateForegroundJSON(self):
+        return self.generateImageUpdateJSON(
+            self.name + "FG",
+            [
+                ("Attack", mergedRuns(self.foregroundImages, self.foregroundUpdates, self.foregroundUpdatesAfterHit)),
+                ("Miss", mergedRuns(self.foregroundImages, self.foregroundUpdates))
+            ],
+            self.foregroundImages,
+            self.getForegroundLayout().cellHeight,
+            self.getForegroundLayout()
+        )
+
+    def generateBackgroundJSON(self):
+        return self.generateImageUpdateJSON(
+            self.name + "BG",
+            [
+                ("Attack", mergedRuns(self.backgroundImages, self.backgroundUpdates, self.backgroundUpdatesAfterHit)),
+                ("Miss", mergedRuns(self.backgroundImages, self.backgroundUpdates))
+            ],
+            self.backgroundImages,
+            BACKGROUND_HEIGHT,
+            self.getBackgroundLayout()
         )
     
+    def generateForegroundPaletteJSON(self):
+        return [
+            "%sFG_Image" % self.name,
+            [[self.foregroundPaletteData[colour], list(colour)] for colour in self.foregroundPaletteData]
+        ]
+
+    def generateBackgroundPaletteJSON(self):
+        return [
+            "%sBG_Image" % self.name,
+            [[self.backgroundPaletteData[colour], list(colour)] for colour in self.backgroundPaletteData]
+        ]
+
     def generateForegroundOnHitPaletteJSON(self):
         return [
             "%sFGHit_Image" % self.name,
@@ -271,38 +600,133 @@ class Spell:
             [[self.backgroundPaletteData[colour], list(colour)] for colour in self.backgroundPaletteData]
         ]
     
-    def getPalettizedSheet(animationPath, images, paletteData, height, offsetX, hasPalette, stretch):
+    # sorted packed colours and the (0, g, b) pixels they map to, for searchsorted lookups
+    def getPaletteLookupTable(paletteData):
 
-        palettizedHeight = 2 * height if stretch else height
-        palettizedSheet = QImage(SCREEN_WIDTH * len(images), palettizedHeight, QImage.Format.Format_RGB32)
-        
-        for (idx, img) in enumerate(images):
-            
-            image = QImage(os.path.join(animationPath, img))
+        keys = np.array([packColour(colour) for colour in paletteData], np.uint32)
+        values = np.array([g << 8 | b for [g, b] in paletteData.values()], np.uint32)
 
-            for y in range(height):
+        order = np.argsort(keys)
 
-                xrange = range(SCREEN_WIDTH) if (not hasPalette or y > 1) else range(SCREEN_WIDTH - 8)
+        return keys[order], values[order]
 
-                for x in xrange:
-                    
-                    colour = image.pixelColor(x + offsetX, y).getRgb()[:-1]
-                    [g, b] = paletteData[colour]
+    def remapFrame(pixels, lookupKeys, lookupValues):
 
-                    outputX = SCREEN_WIDTH * idx + x
-                    outputColour = QColor(0, g, b)
+        indices = np.searchsorted(lookupKeys, pixels)
+        indices[indices == len(lookupKeys)] = 0
 
-                    if stretch:
-                        palettizedSheet.setPixelColor(outputX, 2 * y, outputColour)
-                        palettizedSheet.setPixelColor(outputX, 2 * y + 1, outputColour)
-    
-                    else:
-                        palettizedSheet.setPixelColor(outputX, y, outputColour)
-        
-        return palettizedSheet
-    
-    def getForegroundSheet(self, animationPath):
-        return Spell.getPalettizedSheet(animationPath, self.foregroundImages, self.foregroundPaletteData, self.foregroundImageHeight, 0, False, self.stretchForeground)
+        unknown = lookupKeys[indices] != pixels
+
+        if unknown.any():
+            raise KeyError(unpackColour(pixels[unknown][0]))
+
+        return lookupValues[indices]
+
+    # palette slot indices of one frame, unstretched, in lookupValues' dtype
+    # read through the cache without filling it, the palette pass has already had its use of the frames
+    def palettizeFrame(path, height, offsetX, hasPalette, lookupKeys, lookupValues):
+
+        pixels = frameCache.get(path, store=False)[:height, offsetX:offsetX + SCREEN_WIDTH]
+
+        if pixels.shape != (height, SCREEN_WIDTH):
+            raise ValueError("%s is too small for a %dx%d frame" % (path, SCREEN_WIDTH, height))
+
+        # palette lives in the top-right 8x2 block, don't copy it into the sheet
+        if hasPalette:
+            pixels = pixels.copy()
+            pixels[:2, SCREEN_WIDTH - 8:] = lookupKeys[0]
+
+        frame = Spell.remapFrame(pixels, lookupKeys, lookupValues)
+
+        if hasPalette:
+            frame[:2, SCREEN_WIDTH - 8:] = 0
+
+        return frame
+
+    # slot n of a palette is the sheet colour (0, n % 8, n // 8)
+    def slotsToPixels(slots):
+        return (slots % 8).astype(np.uint32) << 8 | slots // 8
+
+    # yields a page's rows top to bottom as palette slot indices, uint8 for up to 256 colours and uint16 past that
+    # each frame is palettized once into a temporary spool file, then every band of output rows (about a frame's
+    # worth) is read back a slice of each frame at a time and stretched on the way out, so memory stays around
+    # a frame whatever the frame count or sheet width
+    def iterPalettizedPage(animationPath, images, paletteData, height, offsetX, hasPalette, stretch, layout, page, threads=1):
+
+        lookupKeys, lookupValues = Spell.getPaletteLookupTable(paletteData)
+
+        dtype = np.dtype(np.uint8 if Spell.paletteSize(paletteData) <= 256 else np.uint16)
+        lookupSlots = ((lookupValues & 0xFF) * 8 + (lookupValues >> 8)).astype(dtype)
+
+        (width, pageHeight) = layout.pageSize(page)
+        bandRows = max(1, height // layout.columns)
+
+        rowBytes = SCREEN_WIDTH * dtype.itemsize
+        frameBytes = height * rowBytes
+
+        with tempfile.TemporaryFile() as spool:
+
+            spoolLock = threading.Lock()
+
+            for gridRow in range(pageHeight // layout.cellHeight):
+
+                rowStart = page * layout.framesPerPage + gridRow * layout.columns
+                paths = [os.path.join(animationPath, image) for image in images[rowStart:rowStart + layout.columns]]
+
+                def spoolFrame(indexedPath):
+
+                    (column, path) = indexedPath
+                    frame = Spell.palettizeFrame(path, height, offsetX, hasPalette, lookupKeys, lookupSlots)
+
+                    with spoolLock:
+                        spool.seek(column * frameBytes)
+                        spool.write(frame.tobytes())
+
+                mapFrames(spoolFrame, list(enumerate(paths)), threads)
+
+                for bandStart in range(0, height, bandRows):
+
+                    rows = min(bandRows, height - bandStart)
+
+                    # a fresh buffer per band, since prefetched bands are still queued; cells past the last frame stay black
+                    cells = np.zeros((layout.columns, rows, SCREEN_WIDTH), dtype)
+
+                    for column in range(len(paths)):
+                        spool.seek(column * frameBytes + bandStart * rowBytes)
+                        spool.readinto(memoryview(cells[column]).cast("B"))
+
+                    band = cells.transpose(1, 0, 2).reshape(-1, width)
+
+                    yield np.repeat(band, 2, axis=0) if stretch else band
+
+    # number of slots, a quantized palette maps several colours to one slot
+    def paletteSize(paletteData):
+        return len({tuple(index) for index in paletteData.values()})
+
+    # the (0, g, b) index colours in index order, so an indexed sheet decodes to the same pixels as an RGB one
+    def getIndexPalette(paletteData):
+        return [(0, idx % 8, idx // 8) for idx in range(Spell.paletteSize(paletteData))]
+
+    # streams each page into its PNG, so memory no longer grows with the frame count
+    # indexed sheets need at most 256 colours, larger palettes are written as RGB
+    def writePalettizedSheets(paths, animationPath, images, paletteData, height, offsetX, hasPalette, stretch, layout, threads=1, indexed=False):
+
+        palette = Spell.getIndexPalette(paletteData) if indexed and 0 < Spell.paletteSize(paletteData) <= 256 else None
+
+        for page in range(layout.pages):
+            with imagebackends.openImageWriter(paths[page], *layout.pageSize(page), palette) as writer:
+
+                bands = Spell.iterPalettizedPage(animationPath, images, paletteData, height, offsetX, hasPalette, stretch, layout, page, threads)
+
+                # with threads to spare, remapping runs ahead of encoding by a few bands
+                if threads > 1:
+                    bands = prefetch(bands, SHEET_PREFETCH_BANDS)
+
+                for band in bands:
+                    writer.writeRows(band if palette is not None else Spell.slotsToPixels(band))
+
+    def writeForegroundSheets(self, animationPath, paths):
+        Spell.writePalettizedSheets(paths, animationPath, Spell.uniqueImages(self.foregroundImages), self.getForegroundRemapData(), self.foregroundImageHeight, 0, False, self.stretchForeground, self.getForegroundLayout(), self.frameThreads, self.indexedSheets)
 
-    def getBackgroundSheet(self, animationPath):
-        return Spell.getPalettizedSheet(animationPath, self.backgroundImages, self.backgroundPaletteData, BACKGROUND_HEIGHT, 232, True, False)
\ No newline at end of file
+    def writeBackgroundSheets(self, animationPath, paths):
+        Spell.writePalettizedSheets(paths, animationPath, Spell.uniqueImages(self.backgroundImages), self.backgroundPaletteData, BACKGROUND_HEIGHT, 232, True, False, self.getBackgroundLayout(), self.frameThreads, self.indexedSheets)
@@ -0,0 +1,133 @@
+from parse import Parser, readRecords, FRAME_POINTERS
+from concurrent.futures import ThreadPoolExecutor
+import io
+import struct
+
+# stretched, with a sound, a dimness change and a miss terminator
+SPELL_A = """# alpha
+C000053
+C005A48
+O  p- bg_000.png
+   p- fg_000.png
+2
+C001029
+O  p- bg_001.png
+   p- fg_001.png
+3
+C00001F
+O  p- bg_001.png
+   p- fg_002.png
+1
+~
+C000040
+O  p- bg_000.png
+   p- fg_000.png
+4
+"""
+
+# unstretched, different frames, no miss terminator
+SPELL_B = """# beta
+C000029
+O  p- back_a.png
+   p- front_a.png
+5
+O  p- back_b.png
+   p- front_a.png
+1
+C00001F
+O  p- back_b.png
+   p- front_b.png
+2
+"""
+
+def writeScripts(tmp_path):
+
+    paths = []
+
+    for (name, script) in (("alpha", SPELL_A), ("beta", SPELL_B)):
+        path = tmp_path / (name + ".txt")
+        path.write_text(script)
+        paths.append(str(path))
+
+    return paths
+
+# everything the parser produces, as plain lists
+def snapshot(spell):
+
+    return {
+        "globalCommandsOnHit": [list(command) for command in spell.globalCommandsOnHit],
+        "globalCommandsOnMiss": [list(command) for command in spell.globalCommandsOnMiss],
+        "foregroundUpdates": list(spell.foregroundUpdates),
+        "foregroundUpdatesAfterHit": list(spell.foregroundUpdatesAfterHit),
+        "backgroundUpdates": list(spell.backgroundUpdates),
+        "backgroundUpdatesAfterHit": list(spell.backgroundUpdatesAfterHit),
+        "foregroundImages": spell.foregroundImages,
+        "backgroundImages": spell.backgroundImages,
+        "stretchForeground": spell.stretchForeground,
+        "missingSounds": spell.missingSounds
+    }
+
+def parseFresh(path):
+    return snapshot(Parser("spell").parse(path))
+
+def test_reused_parser_matches_fresh_parsers(tmp_path):
+
+    (pathA, pathB) = writeScripts(tmp_path)
+    separate = [parseFresh(pathA), parseFresh(pathB)]
+
+    parser = Parser("spell")
+    reused = [snapshot(parser.parse(pathA)), snapshot(parser.parse(pathB))]
+
+    assert reused == separate
+
+    # and back again, so nothing from B leaks into a second parse of A
+    assert snapshot(parser.parse(pathA)) == separate[0]
+
+    assert separate[0]["stretchForeground"] and not separate[1]["stretchForeground"]
+    assert separate[0] != separate[1]
+
+def test_parsers_in_threads_match_serial_runs(tmp_path):
+
+    paths = writeScripts(tmp_path) * 16
+    serial = [parseFresh(path) for path in paths]
+
+    with ThreadPoolExecutor(8) as executor:
+        threaded = list(executor.map(parseFresh, paths))
+
+    assert threaded == serial
+
+# the script as a ROM stores it, every frame record with all its pointers; each graphic gets its own offset and
+# the OAM, TSA and palette pointers point elsewhere, so reading any of them as a graphic fails the lookup
+def compileScript(script):
+
+    words = []
+    offsets = {}
+
+    for (lineNumber, record, data) in readRecords(io.StringIO(script)):
+
+        if record == "C":
+            (command, first, second) = data
+            words.append(0x85 << 24 | first << 16 | second << 8 | command)
+
+        elif record == "O":
+
+            (foreground, background, duration) = data
+            pointers = {name: 0x08800000 + 0x10 * len(words) + idx for (idx, name) in enumerate(FRAME_POINTERS)}
+
+            for (image, name) in ((foreground, "objGraphics"), (background, "bgGraphics")):
+                pointers[name] = offsets.setdefault(image, 0x08100000 + 0x100 * len(offsets))
+
+            words += [0x86 << 24 | duration] + [pointers[name] for name in FRAME_POINTERS]
+
+        else:
+            words.append(0x80000000)
+
+    return (struct.pack("<%dI" % len(words), *words), {offset: image for (image, offset) in offsets.items()})
+
+def test_compiled_scripts_match_the_text_dump(tmp_path):
+
+    for (path, script) in zip(writeScripts(tmp_path), (SPELL_A, SPELL_B)):
+
+        (compiled, images) = compileScript(script)
+
+        assert snapshot(Parser("spell").parseBinary(compiled, images.__getitem__)) == parseFresh(path)
@@ -0,0 +1,62 @@
+from array import array
+from typing import NamedTuple
+
+# a parent effect command at an absolute frame, unpacks like the old [frame, name, parameters] lists
+class Command(NamedTuple):
+    frame: int
+    name: str
+    parameters: list = None
+
+# image updates as two columns, image filenames and durations in frames
+# appending the image already showing extends its run instead of adding an update
+class Timeline:
+
+    __slots__ = ("images", "durations")
+
+    def __init__(self, updates=()):
+
+        self.images = []
+        self.durations = array("l")
+
+        for (image, duration) in updates:
+            self.append(image, duration)
+
+    def append(self, image, duration):
+
+        if self.images and self.images[-1] == image:
+            self.durations[-1] += duration
+
+        else:
+            self.images.append(image)
+            self.durations.append(duration)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __iter__(self):
+        return zip(self.images, self.durations)
+
+# (nid, duration) of one or more timelines played back to back, merging consecutive images that map to
+# the same nid, which covers the hit/miss boundary as well as frames deduplicated after parsing
+def mergedRuns(nids, *timelines):
+
+    currentNid = None
+    currentDuration = 0
+
+    for timeline in timelines:
+        for (image, duration) in timeline:
+
+            nid = nids[image]
+
+            if nid == currentNid:
+                currentDuration += duration
+                continue
+
+            if currentNid is not None:
+                yield (currentNid, currentDuration)
+
+            currentNid = nid
+            currentDuration = duration
+
+    if currentNid is not None:
+        yield (currentNid, currentDuration)
@@ -0,0 +1,122 @@
+from batch import findSpells
+from main import convertSpell, addOptionArguments, optionsFromArguments
+from framecache import addCacheArgument, cacheBytesFromArguments
+from spell import frameCache
+
+import imagebackends
+import argparse
+import os
+import time
+import traceback
+
+POLL_INTERVAL = 0.2
+
+# wait this long after the last change so a burst of saves triggers one conversion
+DEBOUNCE = 0.3
+
+def snapshotFolder(animationPath):
+
+    snapshot = {}
+
+    for entry in os.scandir(animationPath):
+        if entry.is_file():
+            stat = entry.stat()
+            snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+
+    return snapshot
+
+def findWatchedSpells(watchPaths, outputRoot):
+
+    spells = {}
+
+    for watchPath in watchPaths:
+
+        parentPath = os.path.dirname(os.path.normpath(watchPath))
+
+        for animationPath in findSpells(watchPath):
+            spells[animationPath] = os.path.join(outputRoot, os.path.relpath(animationPath, parentPath))
+
+    return spells
+
+def reconvert(animationPath, outputPath, options, threads):
+
+    spellName = os.path.basename(os.path.normpath(animationPath))
+    start = time.perf_counter()
+
+    try:
+        (spell, status) = convertSpell(spellName, animationPath, outputPath, options=options, threads=threads)
+        print("%-8s %7.2fs  %s" % (status, time.perf_counter() - start, animationPath))
+
+        if spell is not None:
+            for (lineNumber, soundID) in spell.missingSounds:
+                print("          line %d: no sound for ID 0x%X" % (lineNumber, soundID))
+
+    except Exception:
+        print("FAILED   %7.2fs  %s" % (time.perf_counter() - start, animationPath))
+        print("          " + traceback.format_exc().strip().splitlines()[-1])
+
+def watch(watchPaths, outputRoot, options=None, threads=1):
+
+    snapshots = {}
+    pendingSince = {}
+
+    while True:
+
+        spells = findWatchedSpells(watchPaths, outputRoot)
+        now = time.monotonic()
+
+        for (animationPath, outputPath) in spells.items():
+
+            try:
+                snapshot = snapshotFolder(animationPath)
+
+            except OSError:
+                continue
+
+            if snapshots.get(animationPath) != snapshot:
+
+                # first sight of a spell converts it straight away, later edits are debounced
+                if animationPath not in snapshots:
+                    reconvert(animationPath, outputPath, options, threads)
+
+                else:
+                    pendingSince[animationPath] = now
+
+                snapshots[animationPath] = snapshot
+
+            elif animationPath in pendingSince and now - pendingSince[animationPath] >= DEBOUNCE:
+                del pendingSince[animationPath]
+                reconvert(animationPath, outputPath, options, threads)
+
+        for animationPath in list(snapshots):
+            if animationPath not in spells:
+                del snapshots[animationPath]
+                pendingSince.pop(animationPath, None)
+
+        time.sleep(POLL_INTERVAL)
+
+def main():
+
+    argParser = argparse.ArgumentParser(description="Watch spell folders and reconvert a spell whenever its script or frames change.")
+    argParser.add_argument("paths", nargs="+", help="spell folders, or directories containing spell folders")
+    argParser.add_argument("-o", "--output", required=True, help="output directory, one subfolder is created per spell")
+    addOptionArguments(argParser)
+    imagebackends.addBackendArgument(argParser)
+    addCacheArgument(argParser)
+    argParser.add_argument("-t", "--threads", type=int, default=os.cpu_count(), help="threads used to decode and palettize frames (default: CPU count)")
+    args = argParser.parse_args()
+
+    # the backend (and Qt's application object, if used) lives for the whole session along with the frame cache
+    imagebackends.setBackend(args.backend)
+    frameCache.setBudget(cacheBytesFromArguments(args))
+
+    print("watching %s, press Ctrl+C to stop" % ", ".join(args.paths))
+
+    try:
+        watch(args.paths, args.output, optionsFromArguments(args), args.threads)
+
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()